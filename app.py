@@ -1,13 +1,47 @@
 #!/usr/bin/env python3
 from nicegui import ui, run, app
+from fastapi import HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import requests
 import zipfile
-import io
+import os
+import sys
 import ast
 import json
+import argparse
+import atexit
+import codecs
+import bisect
+import cProfile
+import functools
+import hashlib
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import asyncio
+import random
+import secrets
+import subprocess
+import urllib.parse
+import weakref
 import tiktoken
+from collections import OrderedDict, deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Protocol
+from requests.adapters import HTTPAdapter
+from pathlib import Path
 from datetime import datetime
 import re
+from languages import (COMMON_EXCLUDED_DIRS, COMMON_EXCLUDED_NAMES, LANGUAGES, OUTPUT_MODES, extension_map,
+                       get_handler as get_language_handler, language_for_path)
+from sources import (GitSource, RepositorySource, SourceError, ZipSource, process_archive_entry, process_entry_batch,
+                     run_git)
 
 # --- MAGIC Research Brand Colors ---
 BRAND_COLORS = {
@@ -173,78 +207,1474 @@ CUSTOM_CSS = '''
 </style>
 '''
 
+# --- Download Settings ---
+# Archives and outputs up to this size are buffered in memory; larger ones spill to a temp file.
+ARCHIVE_SPOOL_THRESHOLD = int(os.environ.get('REPO2LLM_SPOOL_THRESHOLD', 32 * 1024 * 1024))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Connect and read timeouts (seconds), retries for transient failures and connection pool size
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('REPO2LLM_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('REPO2LLM_READ_TIMEOUT', 30))
+HTTP_RETRIES = int(os.environ.get('REPO2LLM_HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(os.environ.get('REPO2LLM_HTTP_BACKOFF', 0.5))
+HTTP_POOL_SIZE = int(os.environ.get('REPO2LLM_HTTP_POOL_SIZE', 16))
+# Directory for downloaded archives, revalidated with ETags; disabled when unset
+ARCHIVE_CACHE_DIR = os.environ.get('REPO2LLM_ARCHIVE_CACHE_DIR', '')
+ARCHIVE_CACHE_BYTES = int(os.environ.get('REPO2LLM_ARCHIVE_CACHE_MB', 4096)) * 1024 * 1024
+# Optional token for GitHub API calls (ref resolution, repository sizes), raising the unauthenticated rate limit
+GITHUB_TOKEN = os.environ.get('GITHUB_TOKEN', '')
+# Seconds a resolved ref or repository size is reused before the GitHub API (60 calls/hour without a token)
+# or the remote is asked again
+LOOKUP_CACHE_SECONDS = float(os.environ.get('REPO2LLM_LOOKUP_CACHE_SECONDS', 300))
+
+# --- Repository Source Settings ---
+# Directory of partial git mirrors that remote repositories are fetched into instead of downloading archives;
+# disabled when unset
+MIRROR_DIR = os.environ.get('REPO2LLM_MIRROR_DIR', '')
+# Whether the web UI and REST API may read repositories from the server's filesystem (the CLI always may)
+ALLOW_LOCAL_SOURCES = os.environ.get('REPO2LLM_ALLOW_LOCAL', '0') == '1'
+
+# --- Token Counting Settings ---
+TOKEN_ENCODING = "cl100k_base"
+# Threads used by tiktoken's encode_batch, and how many output chunks are encoded per batch
+TOKEN_THREADS = int(os.environ.get('REPO2LLM_TOKEN_THREADS', min(8, os.cpu_count() or 1)))
+TOKEN_BATCH_SIZE = 256
+
+# --- Parallel Processing Settings ---
+# Worker processes used to decode and parse files; 1 processes everything on the calling thread
+PARALLEL_WORKERS = int(os.environ.get('REPO2LLM_WORKERS', os.cpu_count() or 1))
+PARALLEL_BATCH_SIZE = int(os.environ.get('REPO2LLM_BATCH_SIZE', 64))
+# Archives with fewer candidate files are processed serially, where the pool overhead is not worth it
+PARALLEL_MIN_FILES = int(os.environ.get('REPO2LLM_PARALLEL_MIN_FILES', 200))
+
+# --- Job Scheduler Settings ---
+# Repositories processed at once, and how many more may wait in the queue before requests are turned away
+JOB_WORKERS = int(os.environ.get('REPO2LLM_JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('REPO2LLM_JOB_QUEUE', 20))
+# Memory shared by running jobs. A repository of known size is charged its size times an expansion factor that
+# starts at JOB_MEMORY_EXPANSION and then follows the memory growth measured for finished jobs (see
+# JobMemoryModel), plus JOB_MEMORY_OVERHEAD; one of unknown size is charged JOB_MEMORY_ESTIMATE.
+JOB_MEMORY_BUDGET = int(os.environ.get('REPO2LLM_JOB_MEMORY_MB', 1024)) * 1024 * 1024
+JOB_MEMORY_EXPANSION = float(os.environ.get('REPO2LLM_JOB_MEMORY_EXPANSION', 10))
+JOB_MEMORY_ESTIMATE = 2 * ARCHIVE_SPOOL_THRESHOLD
+# Memory every job needs regardless of its size (encoder, parsed trees, per-file index)
+JOB_MEMORY_OVERHEAD = 8 * 1024 * 1024
+# Archives larger than this are rejected while downloading
+MAX_ARCHIVE_BYTES = int(os.environ.get('REPO2LLM_MAX_ARCHIVE_MB', 1024)) * 1024 * 1024
+
+# --- Incremental Processing Settings ---
+# Directory for per-file manifests; when set, unchanged files are reused from the previous run of the same ref
+MANIFEST_DIR = os.environ.get('REPO2LLM_MANIFEST_DIR', '')
+
+# --- Result Cache Settings ---
+CACHE_MEMORY_ENTRIES = int(os.environ.get('REPO2LLM_CACHE_ENTRIES', 32))
+CACHE_MEMORY_BYTES = int(os.environ.get('REPO2LLM_CACHE_MEMORY_MB', 512)) * 1024 * 1024
+# The on-disk store is only enabled when a cache directory is configured
+CACHE_DIR = os.environ.get('REPO2LLM_CACHE_DIR', '')
+CACHE_DISK_BYTES = int(os.environ.get('REPO2LLM_CACHE_DISK_MB', 2048)) * 1024 * 1024
+
+# --- Log Streaming Settings ---
+# The web UI shows buffered progress messages at most once per interval, keeping the last lines on screen
+LOG_FLUSH_INTERVAL = int(os.environ.get('REPO2LLM_LOG_FLUSH_MS', 100)) / 1000
+LOG_MAX_LINES = int(os.environ.get('REPO2LLM_LOG_MAX_LINES', 1000))
+# Messages a job keeps for the log download and for clients that attach later; older ones are dropped
+LOG_HISTORY_LINES = int(os.environ.get('REPO2LLM_LOG_HISTORY_LINES', 20000))
+
+# --- Instrumentation Settings ---
+# When set, every job is profiled with cProfile and tracemalloc and its .prof file is written here
+PROFILE_DIR = os.environ.get('REPO2LLM_PROFILE_DIR', '')
+# Interval (seconds) at which the resident memory of the process is sampled while a job runs
+MEMORY_SAMPLE_INTERVAL = int(os.environ.get('REPO2LLM_MEMORY_SAMPLE_MS', 50)) / 1000
+
+# --- Output Viewer Settings ---
+# The browser preview shows the output one page of this many bytes at a time
+PREVIEW_PAGE_BYTES = int(os.environ.get('REPO2LLM_PREVIEW_PAGE_KB', 64)) * 1024
+
+# --- Progress Reporting ---
+# The pipeline reports progress through any object with push(message, level) and progress(done, total)
+# methods. The adapters below serve the web UI, the REST API and the command line.
+
+# Message levels: per-file details, ordinary progress messages, and problems
+LOG_DETAIL = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_VERBOSITY = {"verbose": LOG_DETAIL, "normal": LOG_INFO, "warnings": LOG_WARNING}
+
+
+class ProgressLog(Protocol):
+    def push(self, message: str, level: int = LOG_INFO) -> None: ...
+
+    def progress(self, done: int, total: int) -> None: ...
+
+
+class CallbackLog:
+    """Forwards progress messages of at least min_level to a callback."""
+
+    def __init__(self, callback: Callable[[str], None], min_level: int = LOG_DETAIL):
+        self.callback = callback
+        self.min_level = min_level
+
+    def push(self, message: str, level: int = LOG_INFO) -> None:
+        if level >= self.min_level:
+            self.callback(message)
+
+    def progress(self, done: int, total: int) -> None:
+        pass
+
+
+class CollectingLog:
+    """Keeps progress messages in a list, e.g. to return them in an API response."""
+
+    def __init__(self):
+        self.messages: list[str] = []
+
+    def push(self, message: str, level: int = LOG_INFO) -> None:
+        self.messages.append(message)
+
+    def progress(self, done: int, total: int) -> None:
+        pass
+
+
+class NullLog:
+    """Discards progress messages."""
+
+    def push(self, message: str, level: int = LOG_INFO) -> None:
+        pass
+
+    def progress(self, done: int, total: int) -> None:
+        pass
+
+
+class BatchedLog:
+    """
+    Buffers progress reported from worker threads so a UI can pick it up in batches, e.g. on a timer,
+    instead of sending one update per message. The last max_messages messages of every level are kept for
+    the full log; only those of at least min_level are handed out for display.
+    """
+
+    def __init__(self, min_level: int = LOG_INFO, max_messages: int = LOG_HISTORY_LINES):
+        self.min_level = min_level
+        self.messages: deque[str] = deque(maxlen=max_messages)
+        self.dropped = 0
+        self._pending: list[str] = []
+        self._progress: tuple[int, int] | None = None
+        self._lock = threading.Lock()
+
+    def push(self, message: str, level: int = LOG_INFO) -> None:
+        with self._lock:
+            if len(self.messages) == self.messages.maxlen:
+                self.dropped += 1
+            self.messages.append(message)
+            if level >= self.min_level:
+                self._pending.append(message)
+
+    def progress(self, done: int, total: int) -> None:
+        with self._lock:
+            self._progress = (done, total)
+
+    def drain(self) -> tuple[list[str], tuple[int, int] | None]:
+        """Returns the messages to display since the last call, and the latest (done, total) progress."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            return pending, self._progress
+
+    def getvalue(self) -> str:
+        """Returns the full log, every level included, noting how many of the earliest messages were dropped."""
+        with self._lock:
+            header = [f"[{self.dropped:,} earlier messages not kept]"] if self.dropped else []
+            return "\n".join([*header, *self.messages]) + "\n"
+
+
+# --- Instrumentation ---
+# Stage timings and counters are collected per job (StageTimings, summarised in the job log) and added to
+# process-wide totals (metrics), which /metrics exports in the Prometheus text format.
+
+def escape_label_value(value: str) -> str:
+    """Escapes a label value for the Prometheus text format: backslashes, double quotes and newlines."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    """Process-wide counters with labels, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._descriptions: dict[str, str] = {}
+        self._values: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, description: str) -> None:
+        self._descriptions[name] = description
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def snapshot(self) -> dict[str, float]:
+        """Returns the current counter values keyed by name, with labels in braces, e.g. for computing deltas."""
+        with self._lock:
+            values = dict(self._values)
+        return {self._series(name, labels): value for (name, labels), value in values.items()}
+
+    @staticmethod
+    def _series(name: str, labels: tuple[tuple[str, str], ...]) -> str:
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{key}="{escape_label_value(label)}"' for key, label in labels) + "}"
+
+    @contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        """Adds the duration of the block to the counter name (in seconds)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(name, time.perf_counter() - start, **labels)
+
+    def render(self, gauges: dict[str, dict] | None = None, counters: dict[str, dict] | None = None) -> str:
+        """
+        Returns every counter in the Prometheus text format, followed by the numeric values of each
+        {prefix: stats dict} in counters as repo2llm_<prefix>_<key>_total counters (for values that only grow)
+        and in gauges as repo2llm_<prefix>_<key> gauges.
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = []
+        current = None
+        for (name, labels), value in values:
+            if name != current:
+                current = name
+                lines.append(f"# HELP {name} {self._descriptions.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{self._series(name, labels)} {value:g}")
+        for kind, suffix, groups in (("counter", "_total", counters), ("gauge", "", gauges)):
+            for prefix, stats in (groups or {}).items():
+                for key, value in stats.items():
+                    if isinstance(value, (int, float)):
+                        lines.append(f"# TYPE repo2llm_{prefix}_{key}{suffix} {kind}")
+                        lines.append(f"repo2llm_{prefix}_{key}{suffix} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.describe("repo2llm_stage_seconds_total", "Time spent in each processing stage.")
+metrics.describe("repo2llm_files_total", "Archive entries by outcome.")
+metrics.describe("repo2llm_archive_bytes_total", "Size of the repository archives processed.")
+metrics.describe("repo2llm_jobs_total", "Processing jobs by result.")
+metrics.describe("repo2llm_token_count_seconds_total", "Time spent counting tokens.")
+metrics.describe("repo2llm_token_count_texts_total", "Texts whose tokens were counted.")
+metrics.describe("repo2llm_ui_update_seconds_total", "Server time spent preparing updates for browser sessions.")
+metrics.describe("repo2llm_ui_updates_total", "Updates pushed to browser sessions.")
+metrics.describe("repo2llm_lookup_cache_total", "Ref and repository size lookups by cache result.")
+
+
+class StageTimings:
+    """Durations and counters of the stages of one job, and optionally its memory use (see MemorySampler)."""
+
+    def __init__(self, memory: "MemorySampler | None" = None):
+        self.started = time.perf_counter()
+        self.seconds: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self.memory = memory
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Adds the duration of the block to stage name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> str:
+        stages = ", ".join(f"{name} {seconds * 1000:,.0f} ms" for name, seconds in self.seconds.items())
+        counters = ", ".join(f"{name.replace('_', ' ')} {value:,}" for name, value in self.counters.items())
+        return f"{stages}; {counters}" if counters else stages
+
+    def publish(self) -> None:
+        """Adds this job's figures to the process-wide metrics."""
+        for name, seconds in self.seconds.items():
+            metrics.inc("repo2llm_stage_seconds_total", seconds, stage=name)
+        for name, value in self.counters.items():
+            if name.startswith("files_"):
+                metrics.inc("repo2llm_files_total", value, outcome=name[len("files_"):])
+        metrics.inc("repo2llm_archive_bytes_total", self.counters.get("archive_bytes", 0))
+
+    def finish(self, log: ProgressLog, result: str) -> None:
+        """Publishes the figures and logs the per-job summary. result is e.g. "done", "cached" or "failed"."""
+        self.publish()
+        metrics.inc("repo2llm_jobs_total", result=result)
+        elapsed = time.perf_counter() - self.started
+        log.push(f"⏱️ Job {result} in {elapsed * 1000:,.0f} ms. {self.summary()}")
+        usage = self.memory.stop() if self.memory is not None else None
+        if usage is not None:
+            peak, growth = usage
+            log.push(f"🧠 Peak memory (RSS) during the job: {peak:.1f} MB, {growth:+.1f} MB over its start")
+
+
+@contextmanager
+def profile_job(name: str, log: ProgressLog, directory: str | None = PROFILE_DIR) -> Iterator[None]:
+    """
+    Profiles the enclosed job with cProfile (calling thread only) and tracemalloc when directory is set,
+    writing <directory>/<name>_<timestamp>.prof and logging the top allocation sites. Does nothing otherwise.
+    tracemalloc is process-wide, so allocations of concurrent jobs are included.
+    """
+    if not directory:
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:5]
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        path = os.path.join(directory, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof")
+        profiler.dump_stats(path)
+        log.push(f"🔬 Profile written to {path}. Traced memory peak {peak / 1024 / 1024:.1f} MB; top allocations: "
+                 + "; ".join(f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} "
+                             f"{stat.size / 1024:,.0f} KB" for stat in top))
+
+
 # --- Core Helper Functions (Preserved from original script) ---
 
-def is_file_type(file_path: str, file_extension: str) -> bool:
-    """Check if the file has the specified file extension."""
-    return file_path.endswith(file_extension)
+def is_file_type(file_path: str, file_extension: str) -> bool:
+    """Check if the file has the specified file extension."""
+    return file_path.endswith(file_extension)
+
+
+def default_path_exclusions(lang: str = "python") -> tuple[list[str], list[str]]:
+    """Returns the built-in (excluded directory names, excluded path substrings) for lang."""
+    handler = get_language_handler(lang)
+    return (COMMON_EXCLUDED_DIRS + list(handler.excluded_dirs),
+            list(handler.excluded_names) + COMMON_EXCLUDED_NAMES)
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translates a gitignore-style glob into a regex matched against a repository-relative path.
+    A pattern with a slash (other than a trailing one) is anchored at the repository root, otherwise it
+    matches at any depth. "*" and "?" stay within one path segment, "**" spans segments, and a pattern
+    matching a directory also matches everything below it. A trailing slash matches directories only.
+    """
+    directory_only = pattern.endswith("/")
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.strip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            close = pattern.index("]", i + 2)
+            members = pattern[i + 1:close].replace("\\", "\\\\")
+            if members.startswith("!"):
+                members = "^" + members[1:]
+            parts.append(f"[{members}]")
+            i = close + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    prefix = "" if anchored else "(?:.*/)?"
+    suffix = "/" if directory_only else "(?:/|$)"
+    return f"^{prefix}{''.join(parts)}{suffix}"
+
+
+def parse_list(text: str | Iterable[str] | None) -> tuple[str, ...]:
+    """Splits a comma- or newline-separated list (or an iterable of such strings) into a tuple of values."""
+    if not text:
+        return ()
+    if isinstance(text, str):
+        text = [text]
+    return tuple(value.strip() for item in text for value in re.split(r"[,\n]", item) if value.strip())
+
+
+class PathFilter:
+    """
+    Decides which repository paths are worth including, compiled once per language and glob settings.
+    The built-in exclusions collapse into a single regex; user globs are gitignore-style. A path is kept when
+    it passes the built-in exclusions, matches at least one include glob (if any are given) and is not
+    excluded by the exclude globs, where a later "!pattern" re-includes a path an earlier glob excluded.
+    """
+
+    def __init__(self, lang: str = "python", include: Iterable[str] = (), exclude: Iterable[str] = ()):
+        excluded_dirs, excluded_names = default_path_exclusions(lang)
+        alternatives = [
+            r"(?:^|/)\.",  # any hidden path segment
+            r"(?i:test)",
+            r"(?:^|/)(?:" + "|".join(map(re.escape, excluded_dirs)) + ")/",
+        ]
+        alternatives.extend(map(re.escape, excluded_names))
+        self._default_exclusions = re.compile("|".join(alternatives))
+        self._include = re.compile("|".join(map(glob_to_regex, include))) if include else None
+        self._exclude = [(glob.startswith("!"), re.compile(glob_to_regex(glob.lstrip("!"))))
+                         for glob in exclude if glob.lstrip("!")]
+
+    def __call__(self, file_path: str) -> bool:
+        if self._default_exclusions.search(file_path):
+            return False
+        if self._include is not None and not self._include.search(file_path):
+            return False
+        keep = True
+        for negated, pattern in self._exclude:
+            if pattern.search(file_path):
+                keep = negated
+        return keep
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_path_filter(lang: str, include: tuple[str, ...], exclude: tuple[str, ...]) -> PathFilter:
+    return PathFilter(lang, include, exclude)
+
+
+def get_path_filter(lang: str = "python", include: Iterable[str] = (), exclude: Iterable[str] = ()) -> PathFilter:
+    """Returns the compiled PathFilter for lang and the given globs, compiling it on first use."""
+    return _compile_path_filter(lang, tuple(include), tuple(exclude))
+
+
+def is_likely_useful_file(file_path: str, lang: str = "python") -> bool:
+    """Determine if the file is likely to be useful by excluding common non-source directories and config files."""
+    return get_path_filter(lang)(file_path)
+
+
+def is_test_file(file_content: str, lang: str, fast: bool = True) -> bool:
+    """
+    Determine if the file content suggests it is a test file, using the test detection of the lang handler.
+    fast only affects how the Python handler searches; both modes give the same answers.
+    """
+    return get_language_handler(lang).is_test_file(file_content, fast)
+
+
+# --- Token Calculation Function ---
+class TokenCountError(RuntimeError):
+    """
+    Raised when the token encoder fails, so no zero counts end up in caches or budgets.
+    Jobs check TokenCounter.load_error first and write their output uncounted if the encoder cannot be loaded.
+    """
+
+
+class TokenCounter:
+    """
+    Counts tokens with a tiktoken encoder that is loaded once, on first use, and shared by all jobs.
+    Batches are encoded with encode_batch, which spreads the work over `threads` threads.
+    """
+
+    def __init__(self, encoding_name: str = TOKEN_ENCODING, threads: int = TOKEN_THREADS):
+        self.encoding_name = encoding_name
+        self.threads = threads
+        self._encoding: tiktoken.Encoding | None = None
+        self._lock = threading.Lock()
+
+    def get_encoding(self) -> tiktoken.Encoding:
+        if self._encoding is None:
+            with self._lock:
+                if self._encoding is None:
+                    self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return self._encoding
+
+    def preload(self) -> None:
+        """Loads the encoder ahead of the first job, ignoring failures (jobs retry through load_error)."""
+        if (error := self.load_error()) is not None:
+            print(f"Could not preload token encoder: {error}")
+
+    def load_error(self) -> str | None:
+        """Loads the encoder if needed. Returns None once it is loaded, else why it could not be."""
+        try:
+            self.get_encoding()
+        except Exception as e:
+            return str(e) or type(e).__name__
+        return None
+
+    def count(self, text: str) -> int:
+        metrics.inc("repo2llm_token_count_texts_total")
+        try:
+            with metrics.time("repo2llm_token_count_seconds_total"):
+                return len(self.get_encoding().encode(text, disallowed_special=()))
+        except Exception as e:
+            raise TokenCountError(f"Could not calculate tokens: {e}") from e
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        """Returns the token count of each text."""
+        if not texts:
+            return []
+        metrics.inc("repo2llm_token_count_texts_total", len(texts))
+        try:
+            with metrics.time("repo2llm_token_count_seconds_total"):
+                encoded = self.get_encoding().encode_batch(texts, num_threads=self.threads, disallowed_special=())
+        except Exception as e:
+            raise TokenCountError(f"Could not calculate tokens: {e}") from e
+        return [len(tokens) for tokens in encoded]
+
+
+token_counter = TokenCounter()
+
+
+def get_token_count(text: str) -> int:
+    """Calculates the number of tokens in a string using the cl100k_base encoding."""
+    return token_counter.count(text)
+
+
+# --- Output Sinks ---
+# The pipeline produces its output as a generator of (file path, chunk) pairs (see iter_output_chunks).
+# Sinks collect those chunks so the download, the size metric and the token count can all be served
+# without rebuilding the concatenated string. An HTTP streaming response can consume the generator directly.
+
+@dataclass
+class OutputFile:
+    """Position of one processed file within the output, with its token count once known."""
+    path: str
+    offset: int
+    size_bytes: int
+    token_count: int | None = None
+
+
+class OutputSink:
+    """Base class for destinations of processed repository output."""
+
+    def __init__(self):
+        self.size_bytes = 0
+        self.token_count: int | None = None
+        self.files: list[OutputFile] = []
+        # Files left out by a token budget (see write_staged_output)
+        self.omitted_files: list[OutputFile] = []
+        # Import index used to order or budget the files, if any (see build_import_index)
+        self.import_index: dict | None = None
+
+    def write(self, chunk: str, file_path: str | None = None) -> None:
+        """Appends a chunk of output. Chunks written with a file_path are recorded in the file index."""
+        size = self._append(chunk)
+        if file_path is not None:
+            self.files.append(OutputFile(file_path, self.size_bytes, size))
+        self.size_bytes += size
+
+    def _append(self, chunk: str) -> int:
+        """Stores a chunk and returns its size in UTF-8 bytes."""
+        raise NotImplementedError
+
+    def iter_chunks(self) -> Iterator[str]:
+        """Yields the collected output in order."""
+        raise NotImplementedError
+
+    def iter_bytes(self) -> Iterator[bytes]:
+        """Yields the collected output UTF-8 encoded, e.g. for downloads."""
+        for chunk in self.iter_chunks():
+            yield chunk.encode("utf-8")
+
+    def getvalue(self) -> str:
+        """Returns the full output as a single string."""
+        return "".join(self.iter_chunks())
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """Returns up to length UTF-8 bytes of output starting at offset."""
+        raise NotImplementedError
+
+    def read_file(self, entry: OutputFile) -> str:
+        """Returns the output chunk of one indexed file."""
+        return self.read_range(entry.offset, entry.size_bytes).decode("utf-8")
+
+    def read_text(self, offset: int, length: int) -> tuple[str, int]:
+        """
+        Returns (text, end offset) for a window of about length bytes starting at offset, e.g. for a page of
+        a preview. The window ends after its last complete line (or character), so consecutive windows
+        starting at the previous end offset never split a character.
+        """
+        data = self.read_range(offset, length)
+        text = codecs.getincrementaldecoder("utf-8")().decode(data)
+        if offset + len(data) < self.size_bytes and "\n" in text:
+            text = text[:text.rindex("\n") + 1]
+        return text, offset + len(text.encode("utf-8"))
+
+    def file_at(self, offset: int) -> OutputFile | None:
+        """Returns the indexed file whose chunk contains offset, or None inside the header."""
+        index = bisect.bisect_right(self.files, offset, key=lambda entry: entry.offset) - 1
+        return self.files[index] if index >= 0 else None
+
+    @property
+    def header_size(self) -> int:
+        """Size in bytes of the metadata header that precedes the first file."""
+        return self.files[0].offset if self.files else self.size_bytes
+
+    def read_header(self) -> str:
+        return self.read_range(0, self.header_size).decode("utf-8")
+
+    def close(self) -> None:
+        pass
+
+
+class StringSink(OutputSink):
+    """Keeps output chunks in a list and joins them only on demand."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: list[str] = []
+        # Byte offset at which each chunk starts, for read_range
+        self._offsets: list[int] = []
+
+    def _append(self, chunk: str) -> int:
+        self._chunks.append(chunk)
+        self._offsets.append(self.size_bytes)
+        return len(chunk.encode("utf-8"))
+
+    def iter_chunks(self) -> Iterator[str]:
+        return iter(self._chunks)
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        index = max(bisect.bisect_right(self._offsets, offset) - 1, 0)
+        parts = []
+        end = offset + length
+        while index < len(self._chunks) and self._offsets[index] < end:
+            parts.append(self._chunks[index].encode("utf-8"))
+            index += 1
+        if not parts:
+            return b""
+        data = b"".join(parts)
+        start = offset - self._offsets[index - len(parts)]
+        return data[start:start + length]
+
+    def close(self) -> None:
+        self._chunks.clear()
+        self._offsets.clear()
+
+
+class TempFileSink(OutputSink):
+    """
+    Writes output UTF-8 encoded to a spooled temporary file that spills to disk above max_size bytes.
+    Reads keep their own position, so a finished sink can be shared by several readers at once.
+    """
+
+    def __init__(self, max_size: int = ARCHIVE_SPOOL_THRESHOLD):
+        super().__init__()
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self._lock = threading.Lock()
+
+    def _append(self, chunk: str) -> int:
+        return self._write_block(chunk.encode("utf-8"))
+
+    def write_bytes(self, block: bytes) -> None:
+        """Appends already UTF-8 encoded output without recording it in the file index."""
+        self.size_bytes += self._write_block(block)
+
+    def _write_block(self, block: bytes) -> int:
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            return self._file.write(block)
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """Returns up to length bytes starting at offset."""
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    def iter_bytes(self) -> Iterator[bytes]:
+        offset = 0
+        while block := self.read_range(offset, DOWNLOAD_CHUNK_SIZE):
+            offset += len(block)
+            yield block
+
+    def iter_chunks(self) -> Iterator[str]:
+        # Blocks may split multi-byte characters, so decode incrementally
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for block in self.iter_bytes():
+            yield decoder.decode(block)
+        yield decoder.decode(b"", final=True)
+
+    def read_bytes(self) -> bytes:
+        return self.read_range(0, self.size_bytes)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# --- Result Cache ---
+# Processed outputs are content-addressed by the resolved commit SHA, so repeat requests for the same
+# repository state are served without downloading the archive again.
+
+def make_cache_key(repo_url: str, commit_sha: str, branch_or_tag: str, filter_settings: dict, output_format: str) -> str:
+    """
+    Builds the cache key for a processed repository. Keys are only built once the ref is resolved to a commit,
+    so outputs of branches are never served stale. The ref name is part of the key because it is written
+    into the output header.
+    """
+    key_data = json.dumps([repo_url.rstrip("/"), commit_sha, branch_or_tag, filter_settings, output_format],
+                          sort_keys=True)
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of processed outputs held in memory, backed by an optional on-disk store.
+    The memory tier is bounded by entry count and total bytes; the disk tier evicts the least recently
+    used files once cache_dir exceeds disk_bytes.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MEMORY_ENTRIES, max_bytes: int = CACHE_MEMORY_BYTES,
+                 cache_dir: str = CACHE_DIR, disk_bytes: int = CACHE_DISK_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_bytes = disk_bytes
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: OrderedDict[str, OutputSink] = OrderedDict()
+        self._indexes: OrderedDict[str, dict] = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+
+    def get(self, key: str) -> OutputSink | None:
+        """Returns the cached output for key, promoting disk entries into memory, or None on a miss."""
+        with self._lock:
+            output = self._entries.get(key)
+            if output is not None:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return output
+
+        output = self._load_from_disk(key)
+        with self._lock:
+            if output is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._store_in_memory(key, output)
+        return output
+
+    def put(self, key: str, output: OutputSink) -> None:
+        """Stores a finished output. Its token_count must already be set."""
+        with self._lock:
+            self._store_in_memory(key, output)
+        self._save_to_disk(key, output)
+
+    def get_index(self, key: str) -> dict | None:
+        """Returns the import index (see build_import_index) stored under key, or None."""
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        if self.cache_dir is None:
+            return None
+        try:
+            index = json.loads((self.cache_dir / f"{key}.index.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        self._store_index(key, index)
+        return index
+
+    def put_index(self, key: str, index: dict) -> None:
+        """Stores an import index in memory and, with a cache directory, next to the stored outputs."""
+        self._store_index(key, index)
+        if self.cache_dir is not None:
+            try:
+                (self.cache_dir / f"{key}.index.json").write_text(json.dumps(index), encoding="utf-8")
+            except OSError as e:
+                print(f"Could not write import index: {e}")
+            finally:
+                self._evict_disk()
+
+    def _store_index(self, key: str, index: dict) -> None:
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the hit/miss/eviction counters and current occupancy."""
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "memory_bytes": self._memory_bytes}
+
+    def _store_in_memory(self, key: str, output: OutputSink) -> None:
+        # Callers hold self._lock. Evicted outputs are not closed because clients may still be reading them.
+        if key in self._entries:
+            self._memory_bytes -= self._entries.pop(key).size_bytes
+        if output.size_bytes > self.max_bytes:
+            return
+        self._entries[key] = output
+        self._memory_bytes += output.size_bytes
+        while len(self._entries) > self.max_entries or self._memory_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._memory_bytes -= evicted.size_bytes
+            self.counters["evictions"] += 1
+
+    def _load_from_disk(self, key: str) -> OutputSink | None:
+        if self.cache_dir is None:
+            return None
+        text_path = self.cache_dir / f"{key}.txt"
+        meta_path = self.cache_dir / f"{key}.json"
+        try:
+            metadata = json.loads(meta_path.read_text(encoding="utf-8"))
+            output = TempFileSink()
+            # Copy into a private buffer so a concurrent disk eviction cannot pull the file from under a reader
+            with open(text_path, "rb") as stored:
+                while block := stored.read(DOWNLOAD_CHUNK_SIZE):
+                    output.write_bytes(block)
+            os.utime(text_path)
+        except (OSError, ValueError):
+            return None
+        output.token_count = metadata.get("token_count")
+        output.files = [OutputFile(*entry) for entry in metadata.get("files", [])]
+        output.omitted_files = [OutputFile(*entry) for entry in metadata.get("omitted_files", [])]
+        return output
+
+    def _save_to_disk(self, key: str, output: OutputSink) -> None:
+        if self.cache_dir is None:
+            return
+        # Evicts even when the entry is skipped or fails to save, so the store never stays over its limit
+        try:
+            if output.size_bytes <= self.disk_bytes:
+                self._write_to_disk(key, output)
+        finally:
+            self._evict_disk()
+
+    def _write_to_disk(self, key: str, output: OutputSink) -> None:
+        text_path = self.cache_dir / f"{key}.txt"
+        partial = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".partial", delete=False) as partial:
+                for block in output.iter_bytes():
+                    partial.write(block)
+            os.replace(partial.name, text_path)
+            metadata = {
+                "token_count": output.token_count,
+                "size_bytes": output.size_bytes,
+                "files": [[f.path, f.offset, f.size_bytes, f.token_count] for f in output.files],
+                "omitted_files": [[f.path, f.offset, f.size_bytes, f.token_count] for f in output.omitted_files],
+            }
+            (self.cache_dir / f"{key}.json").write_text(json.dumps(metadata), encoding="utf-8")
+        except OSError as e:
+            print(f"Could not write result cache entry: {e}")
+            if partial is not None:
+                Path(partial.name).unlink(missing_ok=True)
+
+    def _evict_disk(self) -> None:
+        stored = []
+        for text_path in [*self.cache_dir.glob("*.txt"), *self.cache_dir.glob("*.index.json")]:
+            try:
+                stat = text_path.stat()
+            except OSError:
+                continue
+            stored.append((stat.st_mtime, stat.st_size, text_path))
+        total = sum(size for _, size, _ in stored)
+        for _, size, text_path in sorted(stored):
+            if total <= self.disk_bytes:
+                break
+            text_path.unlink(missing_ok=True)
+            text_path.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.counters["disk_evictions"] += 1
+
+
+result_cache = ResultCache()
+
+
+# --- Incremental Processing ---
+# A manifest records, for each candidate file of a repository ref, its content version (the CRC-32 and size
+# from the zip central directory, or the git blob id), the filter verdict, the token count and the stored file
+# content. On the next run entries with the same version are taken from the manifest, so only new or changed
+# files are read, parsed and tokenized.
+
+class FileManifest:
+    """The manifest of one repository ref, open for a single processing run."""
+
+    def __init__(self, directory: Path, lock: threading.Lock):
+        self.directory = directory
+        self.pieces_dir = directory / "pieces"
+        self._lock = lock
+        try:
+            self._previous = json.loads((directory / "manifest.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self._previous = {}
+        self._current: dict[str, dict] = {}
+        self.reused = 0
+        self.processed = 0
+
+    @staticmethod
+    def _piece_name(path: str, version: list) -> str:
+        return hashlib.sha1(json.dumps([path, version]).encode("utf-8")).hexdigest() + ".txt"
+
+    def lookup(self, path: str, version: list) -> dict | None:
+        """Returns the previous entry for path if its version (see RepositorySource.version) is unchanged."""
+        entry = self._previous.get(path)
+        if entry is None or entry.get("version") != version:
+            return None
+        if entry["verdict"] == "ok" and not (self.pieces_dir / entry["piece"]).is_file():
+            return None
+        return entry
+
+    def restore(self, path: str, entry: dict) -> tuple[str, str, list[str] | None]:
+        """
+        Returns the (status, payload, imports) recorded for an unchanged entry, like process_archive_entry.
+        imports is None if they were not collected when the entry was recorded.
+        """
+        self._current[path] = entry
+        self.reused += 1
+        if entry["verdict"] == "ok":
+            return "ok", (self.pieces_dir / entry["piece"]).read_text(encoding="utf-8"), entry.get("imports")
+        return entry["verdict"], entry.get("error", ""), None
+
+    def record(self, path: str, version: list, status: str, payload: str, imports: list[str] | None = None) -> None:
+        """Records a freshly processed entry, storing its content (and imports, if collected) if it is kept."""
+        entry = {"version": version, "verdict": status, "tokens": None, "original_tokens": None, "imports": imports}
+        if status == "ok":
+            entry["piece"] = self._piece_name(path, version)
+            self.pieces_dir.mkdir(parents=True, exist_ok=True)
+            (self.pieces_dir / entry["piece"]).write_text(payload, encoding="utf-8")
+        elif status == "error":
+            entry["error"] = payload
+        self._current[path] = entry
+        self.processed += 1
+
+    def known_tokens(self, path: str) -> int | None:
+        entry = self._current.get(path)
+        return entry["tokens"] if entry is not None else None
+
+    def set_tokens(self, path: str, tokens: int) -> None:
+        if path in self._current:
+            self._current[path]["tokens"] = tokens
+
+    def original_tokens(self, path: str) -> int | None:
+        """Returns the token count of the uncompressed chunk of a file the output mode changed, if recorded."""
+        entry = self._current.get(path)
+        return entry.get("original_tokens") if entry is not None else None
+
+    def set_original_tokens(self, path: str, tokens: int) -> None:
+        if path in self._current:
+            self._current[path]["original_tokens"] = tokens
+
+    def save(self) -> None:
+        """Writes the manifest of this run and deletes stored content no longer referenced by it."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        partial = self.directory / "manifest.json.partial"
+        partial.write_text(json.dumps(self._current), encoding="utf-8")
+        os.replace(partial, self.directory / "manifest.json")
+        referenced = {entry["piece"] for entry in self._current.values() if "piece" in entry}
+        if self.pieces_dir.is_dir():
+            for piece in self.pieces_dir.iterdir():
+                if piece.name not in referenced:
+                    piece.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self._lock.release()
+
+
+class ManifestStore:
+    """
+    Keeps one manifest directory per (repository, ref, filter settings) under root. download_and_process_repo
+    uses manifest_store unless given a store, so only files changed since the last run of a ref are processed.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    @contextmanager
+    def open(self, repo_url: str, branch_or_tag: str, filter_settings: dict) -> Iterator[FileManifest]:
+        """
+        Opens the manifest for one run. Runs for the same manifest are serialized; the manifest is saved
+        when the block completes without an error.
+        """
+        key_data = json.dumps([repo_url.rstrip("/"), branch_or_tag, filter_settings], sort_keys=True)
+        key = hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        lock.acquire()
+        manifest = FileManifest(self.root / key, lock)
+        try:
+            yield manifest
+            manifest.save()
+        finally:
+            manifest.close()
+
+
+manifest_store = ManifestStore(MANIFEST_DIR) if MANIFEST_DIR else None
+
+
+# --- Token Budget ---
+# Orders in which files are considered when packing output into a token budget
+BUDGET_PRIORITIES = {
+    "order": "Output order",
+    "smallest": "Smallest files first",
+    "shallowest": "Top-level files first",
+    "central": "Most central files first",
+}
+
+
+def select_files_within_budget(staging: OutputSink, budget: int, priority: str,
+                               files: list[OutputFile] | None = None,
+                               index: dict | None = None) -> tuple[set[str], list[OutputFile]]:
+    """
+    Greedily picks files from staging.files, or files (the same files in output order), in priority order
+    while they fit in budget tokens. "central" follows the centrality ranking of the import index (see
+    build_import_index), built from the staged files unless index is given.
+    Returns (paths of the selected files, omitted files in priority order).
+    """
+    files = staging.files if files is None else files
+    if priority == "smallest":
+        ordered = sorted(files, key=lambda f: f.token_count)
+    elif priority == "shallowest":
+        ordered = sorted(files, key=lambda f: f.path.count("/"))
+    elif priority == "central":
+        if index is None:
+            index = build_import_index({f.path: sorted(file_imports(f.path, staging.read_file(f))) for f in files})
+        rank = {path: i for i, path in enumerate(index["centrality"])}
+        ordered = sorted(files, key=lambda f: rank.get(f.path, len(rank)))
+    elif priority == "order":
+        ordered = list(files)
+    else:
+        raise ValueError(f"Unknown budget priority: {priority}")
+
+    selected, omitted = set(), []
+    remaining = budget
+    for entry in ordered:
+        if entry.token_count <= remaining:
+            selected.add(entry.path)
+            remaining -= entry.token_count
+        else:
+            omitted.append(entry)
+    return selected, omitted
+
+
+# --- Sharded Output ---
+# Splits a finished output into parts at file boundaries, each under a token and/or byte limit, for
+# ingestion across several context windows. Parts are planned from the per-file index, so nothing is
+# re-encoded, and written straight from the sink, so the full output is never held in one buffer.
+
+def plan_shards(output: OutputSink, max_tokens: int | None = None,
+                max_bytes: int | None = None) -> list[list[OutputFile]]:
+    """
+    Groups output.files into consecutive parts. Every part repeats the metadata header, which counts
+    towards its limits. A single file larger than a limit gets a part of its own.
+    """
+    overhead_tokens = 0
+    if max_tokens is not None:
+        header_tokens = (output.token_count or 0) - sum(f.token_count or 0 for f in output.files)
+        # Account for the "# Part i of N" banner written above each part's header
+        overhead_tokens = header_tokens + token_counter.count(shard_banner(len(output.files), len(output.files)))
+    overhead_bytes = output.header_size + len(shard_banner(len(output.files), len(output.files)).encode("utf-8"))
+
+    shards: list[list[OutputFile]] = []
+    current: list[OutputFile] = []
+    tokens, size = overhead_tokens, overhead_bytes
+    for entry in output.files:
+        over_tokens = max_tokens is not None and tokens + (entry.token_count or 0) > max_tokens
+        over_bytes = max_bytes is not None and size + entry.size_bytes > max_bytes
+        if current and (over_tokens or over_bytes):
+            shards.append(current)
+            current, tokens, size = [], overhead_tokens, overhead_bytes
+        current.append(entry)
+        tokens += entry.token_count or 0
+        size += entry.size_bytes
+    if current or not shards:
+        shards.append(current)
+    return shards
+
+
+def shard_banner(index: int, count: int) -> str:
+    return f"# Part {index} of {count}\n"
+
+
+def iter_shard_bytes(output: OutputSink, shard: list[OutputFile], index: int, count: int) -> Iterator[bytes]:
+    """Yields the UTF-8 content of one part: banner, metadata header, then its files."""
+    yield shard_banner(index, count).encode("utf-8")
+    yield output.read_range(0, output.header_size)
+    for entry in shard:
+        yield output.read_range(entry.offset, entry.size_bytes)
+
+
+def shard_filenames(filename: str, count: int) -> list[str]:
+    """Names the parts of filename, e.g. repo_main.txt -> repo_main_part01of03.txt."""
+    stem, dot, extension = filename.rpartition(".")
+    if not dot:
+        stem, extension = filename, "txt"
+    width = max(2, len(str(count)))
+    return [f"{stem}_part{i:0{width}d}of{count:0{width}d}.{extension}" for i in range(1, count + 1)]
+
+
+def write_shards(output: OutputSink, shards: list[list[OutputFile]], filename: str, directory: str,
+                 as_zip: bool = True) -> list[str]:
+    """
+    Writes the parts into directory, either as one zip archive or as separate text files.
+    Returns the paths of the written files.
+    """
+    names = shard_filenames(filename, len(shards))
+    if as_zip:
+        zip_path = os.path.join(directory, f"{filename.rpartition('.')[0] or filename}_parts.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for index, (name, shard) in enumerate(zip(names, shards), start=1):
+                with archive.open(name, "w") as part:
+                    for block in iter_shard_bytes(output, shard, index, len(shards)):
+                        part.write(block)
+        return [zip_path]
+
+    paths = []
+    for index, (name, shard) in enumerate(zip(names, shards), start=1):
+        path = os.path.join(directory, name)
+        with open(path, "wb") as part:
+            for block in iter_shard_bytes(output, shard, index, len(shards)):
+                part.write(block)
+        paths.append(path)
+    return paths
+
+
+# --- Import Graph ---
+# Files can be output in dependency or centrality order of the intra-repository import graph. The graph and
+# both rankings form an import index, computed once per commit and filter settings and cached next to the
+# outputs, so every budget, order and shard request for that commit reuses it. The import helpers live in the
+# Python handler and are imported on first use, like the handler itself (see languages.get_handler).
+
+# Orders in which files are written to the output
+OUTPUT_ORDERS = {
+    "archive": "Archive order",
+    "dependency": "Dependencies first",
+    "centrality": "Most central first",
+}
+
+
+def extract_imports(source: str, module_name: str, is_package: bool) -> set[str]:
+    """Returns the absolute dotted names a module imports, resolving relative imports against module_name."""
+    from languages.python import imported_names
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return set()
+    return imported_names(tree, module_name, is_package)
+
+
+def file_imports(file_path: str, source: str) -> set[str]:
+    """Returns the modules a Python file imports; files in other languages add no edges to the graph."""
+    if not file_path.endswith(".py"):
+        return set()
+    from languages.python import module_name_for_path
+    return extract_imports(source, module_name_for_path(file_path), file_path.endswith("__init__.py"))
+
+
+def resolve_import_graph(imports: dict[str, Iterable[str]]) -> dict[str, set[str]]:
+    """
+    Resolves {path: imported dotted names} into the intra-repository import graph, {path: set of paths it
+    imports}. Modules are matched by dotted-name suffix, so imports resolve whether or not the package lives
+    under a src/ style prefix.
+    """
+    from languages.python import module_name_for_path
+    by_suffix: dict[str, list[str]] = {}
+    for path in imports:
+        parts = module_name_for_path(path).split(".")
+        for start in range(len(parts)):
+            by_suffix.setdefault(".".join(parts[start:]), []).append(path)
+
+    graph = {}
+    for path, names in imports.items():
+        targets = set()
+        for name in names:
+            matches = by_suffix.get(name, [])
+            # Ambiguous short names (e.g. "utils" in several packages) are not resolved
+            if len(matches) == 1 and matches[0] != path:
+                targets.add(matches[0])
+        graph[path] = targets
+    return graph
+
+
+def dependency_order(paths: list[str], graph: dict[str, Iterable[str]]) -> list[str]:
+    """
+    Orders paths so that every file comes after the files it imports, except inside import cycles.
+    A depth-first walk places each file's not yet placed dependencies right before it, so related code stays
+    together; otherwise paths keep their given order.
+    """
+    position = {path: i for i, path in enumerate(paths)}
+    ordered, visited = [], set()
+    for root in paths:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(sorted(graph.get(root, ()), key=position.__getitem__)))]
+        while stack:
+            path, dependencies = stack[-1]
+            for dependency in dependencies:
+                if dependency not in visited:
+                    visited.add(dependency)
+                    stack.append((dependency, iter(sorted(graph.get(dependency, ()), key=position.__getitem__))))
+                    break
+            else:
+                stack.pop()
+                ordered.append(path)
+    return ordered
+
+
+def centrality_scores(paths: list[str], graph: dict[str, Iterable[str]], damping: float = 0.85,
+                      iterations: int = 30) -> dict[str, float]:
+    """PageRank over the import graph: a file is central when central files import it."""
+    if not paths:
+        return {}
+    share = 1 / len(paths)
+    scores = dict.fromkeys(paths, share)
+    for _ in range(iterations):
+        dangling = sum(scores[path] for path in paths if not graph.get(path))
+        updated = dict.fromkeys(paths, (1 - damping) * share + damping * dangling * share)
+        for path in paths:
+            targets = graph.get(path)
+            if targets:
+                weight = damping * scores[path] / len(targets)
+                for target in targets:
+                    updated[target] += weight
+        scores = updated
+    return scores
+
+
+def build_import_index(imports: dict[str, Iterable[str]]) -> dict:
+    """
+    Resolves {path: imported dotted names}, in output order, into an import index: the graph as
+    {path: sorted imported paths} and the ranked paths for every order of OUTPUT_ORDERS but "archive".
+    """
+    graph = resolve_import_graph(imports)
+    paths = list(imports)
+    scores = centrality_scores(paths, graph)
+    return {
+        "graph": {path: sorted(targets) for path, targets in graph.items()},
+        "dependency": dependency_order(paths, graph),
+        "centrality": sorted(paths, key=lambda path: -scores[path]),
+    }
+
+
+# --- Memory Reporting ---
+# ru_maxrss only ever grows over the life of the process, so per-job figures come from sampling the current
+# resident set size while the job runs. The process is shared, so concurrent jobs add to each other's samples.
+
+def get_rss_bytes() -> int | None:
+    """Returns the current resident set size of this process in bytes, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class MemorySampler:
+    """Tracks the peak resident set size of the process from creation until stop(), on a daemon thread."""
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.start_bytes = get_rss_bytes()
+        self.peak_bytes = self.start_bytes or 0
+        self._stopped = threading.Event()
+        self._thread = None
+        if self.start_bytes is not None:
+            # The thread only holds a weak reference, so a job that raises before stop() does not leak it
+            self._thread = threading.Thread(target=MemorySampler._run, name="rss-sampler", daemon=True,
+                                            args=(weakref.ref(self), self._stopped, interval))
+            self._thread.start()
+
+    @staticmethod
+    def _run(sampler_ref: "weakref.ref[MemorySampler]", stopped: threading.Event, interval: float) -> None:
+        while not stopped.wait(interval):
+            sampler = sampler_ref()
+            if sampler is None:
+                return
+            sampler._sample()
+            del sampler
+
+    def _sample(self) -> None:
+        rss = get_rss_bytes()
+        if rss is not None and rss > self.peak_bytes:
+            self.peak_bytes = rss
+
+    def stop(self) -> tuple[float, float] | None:
+        """Stops sampling and returns (peak RSS, peak minus RSS at start) in MB, or None if RSS is unavailable."""
+        self._stopped.set()
+        if self._thread is None:
+            return None
+        self._thread.join()
+        self._sample()
+        return self.peak_bytes / (1024 * 1024), (self.peak_bytes - self.start_bytes) / (1024 * 1024)
+
+
+# --- HTTP Client ---
+# All outgoing requests share one connection-pooled session, so repeated fetches from the same host reuse
+# TLS connections. Connection errors, timeouts and 429/5xx responses are retried with jittered exponential
+# backoff. Downloaded archives can be kept on disk and revalidated with If-None-Match.
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """Shared requests session with retries, separate connect/read timeouts and transfer metrics."""
+
+    def __init__(self, retries: int = HTTP_RETRIES, backoff: float = HTTP_BACKOFF,
+                 connect_timeout: float = HTTP_CONNECT_TIMEOUT, read_timeout: float = HTTP_READ_TIMEOUT,
+                 pool_size: int = HTTP_POOL_SIZE):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.metrics = {"requests": 0, "retries": 0, "not_modified": 0, "bytes_downloaded": 0,
+                        "download_seconds": 0.0}
+
+    def wait_before_retry(self, attempt: int, response: requests.Response | None = None) -> None:
+        """Sleeps before retry number attempt (0-based), honouring a Retry-After header when present."""
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            delay = min(float(retry_after), 60.0)
+        else:
+            delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+        with self._lock:
+            self.metrics["retries"] += 1
+        time.sleep(delay)
+
+    def get(self, url: str, headers: dict | None = None, stream: bool = False,
+            retries: int | None = None) -> requests.Response:
+        """GET with retries on connection errors, timeouts and retryable status codes."""
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            with self._lock:
+                self.metrics["requests"] += 1
+            try:
+                response = self.session.get(url, headers=headers, stream=stream, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == retries:
+                    raise
+                self.wait_before_retry(attempt)
+                continue
+            if response.status_code in RETRY_STATUS_CODES and attempt < retries:
+                response.close()
+                self.wait_before_retry(attempt, response)
+                continue
+            return response
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self.metrics["not_modified"] += 1
+
+    def record_download(self, size: int, seconds: float) -> None:
+        with self._lock:
+            self.metrics["bytes_downloaded"] += size
+            self.metrics["download_seconds"] += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.metrics)
+
+
+http_client = HttpClient()
+
+
+class ArchiveCache:
+    """
+    Keeps downloaded archives on disk with their ETags, evicting the least recently used beyond max_bytes.
+    Archives of a specific commit never change, so they are reused without revalidation.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = ARCHIVE_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.directory / f"{key}.zip", self.directory / f"{key}.json"
+
+    def lookup(self, url: str) -> tuple[Path, str] | None:
+        """Returns (archive path, ETag) for a cached url, or None."""
+        archive_path, meta_path = self._paths(url)
+        try:
+            etag = json.loads(meta_path.read_text(encoding="utf-8")).get("etag", "")
+        except (OSError, ValueError):
+            return None
+        return (archive_path, etag) if archive_path.is_file() else None
+
+    def touch(self, url: str) -> None:
+        self._paths(url)[0].touch(exist_ok=True)
 
+    def new_download(self) -> BinaryIO:
+        """Returns a temporary file in the cache directory to download into."""
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix=".partial", delete=False)
 
-def is_likely_useful_file(file_path: str, lang: str = "python") -> bool:
-    """Determine if the file is likely to be useful by excluding common non-source directories and config files."""
-    excluded_dirs = ["docs", "examples", "tests", "test", "scripts", "utils", "benchmarks"]
-    utility_or_config_files = []
-    github_workflow_or_docs = [".github", ".gitignore", "LICENSE"]
-
-    if lang == "python":
-        excluded_dirs.append("__pycache__")
-        utility_or_config_files.extend(["hubconf.py", "setup.py"])
-        github_workflow_or_docs.extend(["stale.py", "gen-card-", "write_model_card"])
-    elif lang == "go":
-        excluded_dirs.append("vendor")
-        utility_or_config_files.extend(["go.mod", "go.sum", "Makefile"])
-
-    if any(part.startswith(".") for part in file_path.split("/")):
-        return False
-    if "test" in file_path.lower():
-        return False
-    for excluded_dir in excluded_dirs:
-        if f"/{excluded_dir}/" in file_path or file_path.startswith(excluded_dir + "/"):
-            return False
-    for file_name in utility_or_config_files:
-        if file_name in file_path:
-            return False
-    for doc_file in github_workflow_or_docs:
-        if doc_file in file_path:
-            return False
-    return True
+    def store(self, url: str, download: BinaryIO, etag: str) -> Path:
+        """Moves a finished download into place and records its ETag."""
+        archive_path, meta_path = self._paths(url)
+        download.close()
+        os.replace(download.name, archive_path)
+        meta_path.write_text(json.dumps({"url": url, "etag": etag}), encoding="utf-8")
+        self._evict()
+        return archive_path
 
+    def _evict(self) -> None:
+        stored = []
+        for archive_path in self.directory.glob("*.zip"):
+            try:
+                stat = archive_path.stat()
+            except OSError:
+                continue
+            stored.append((stat.st_mtime, stat.st_size, archive_path))
+        total = sum(size for _, size, _ in stored)
+        for _, size, archive_path in sorted(stored):
+            if total <= self.max_bytes:
+                break
+            archive_path.unlink(missing_ok=True)
+            archive_path.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
 
-def is_test_file(file_content: str, lang: str) -> bool:
-    """Determine if the file content suggests it is a test file by checking for testing library imports."""
-    test_indicators = {"python": ["unittest", "pytest"], "go": ["testing"]}.get(lang, [])
 
-    if lang == "python":
-        try:
-            module = ast.parse(file_content)
-            for node in ast.walk(module):
-                if isinstance(node, ast.Import):
-                    for alias in node.names:
-                        if alias.name in test_indicators:
-                            return True
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module in test_indicators:
-                        return True
-        except SyntaxError:
-            pass
-    return False
+archive_cache = ArchiveCache(ARCHIVE_CACHE_DIR) if ARCHIVE_CACHE_DIR else None
 
 
-# --- Token Calculation Function ---
-def get_token_count(text: str) -> int:
-    """Calculates the number of tokens in a string using the cl100k_base encoding."""
-    try:
-        encoding = tiktoken.get_encoding("cl100k_base")
-        tokens = encoding.encode(text, disallowed_special=())
-        return len(tokens)
-    except Exception as e:
-        print(f"Could not calculate tokens: {e}")
-        return 0
+class LookupCache:
+    """Results of remote lookups, reused for `seconds` so repeated jobs for a repository and ref do not repeat them."""
+
+    def __init__(self, seconds: float = LOOKUP_CACHE_SECONDS, max_entries: int = 1024):
+        self.seconds = seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()  # key -> (expiry, value)
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, lookup: Callable[[], object]) -> object:
+        """Returns the unexpired value stored under key, else lookup()'s result, stored unless it is None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                metrics.inc("repo2llm_lookup_cache_total", result="hit")
+                return entry[1]
+        metrics.inc("repo2llm_lookup_cache_total", result="miss")
+        # Failed lookups return None and are retried by the next job
+        value = lookup()
+        if value is not None:
+            with self._lock:
+                self._entries[key] = (now + self.seconds, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+
+lookup_cache = LookupCache()
 
 
 # --- Helper function to extract repo name from URL ---
 def get_repo_name_from_url(url: str) -> str:
-    """Extract repository name from GitHub URL."""
+    """Extract repository name from GitHub URL, or the last path segment of other URLs and local paths."""
     # Pattern to match GitHub URLs
     pattern = r'github\.com[/:]([^/]+)/([^/\.]+)'
     match = re.search(pattern, url)
@@ -252,34 +1682,647 @@ def get_repo_name_from_url(url: str) -> str:
         owner = match.group(1)
         repo = match.group(2).replace('.git', '')
         return f"{owner}_{repo}"
-    return "repository"
+    name = urllib.parse.urlparse(url).path.rstrip("/").rsplit("/", 1)[-1].removesuffix(".git")
+    return re.sub(r'[^\w.-]', "_", name) or "repository"
+
+
+def resolve_commit_sha(repo_url: str, ref: str) -> str | None:
+    """
+    Resolves a branch, tag or commit to its full commit SHA, through the GitHub API for GitHub URLs and with
+    `git ls-remote` for other remote URLs or when the API fails. Returns None when the ref cannot be resolved.
+    Resolved refs are reused for LOOKUP_CACHE_SECONDS, so a branch that moves is picked up after that.
+    """
+    return lookup_cache.get(("commit", repo_url.rstrip("/"), ref), lambda: _resolve_commit_sha(repo_url, ref))
+
+
+def _resolve_commit_sha(repo_url: str, ref: str) -> str | None:
+    match = re.search(r'github\.com[/:]([^/]+)/([^/]+?)(?:\.git)?/?$', repo_url)
+    if match:
+        owner, repo = match.groups()
+        headers = {"Accept": "application/vnd.github.sha"}
+        if GITHUB_TOKEN:
+            headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
+        try:
+            response = http_client.get(f"https://api.github.com/repos/{owner}/{repo}/commits/{ref}",
+                                       headers=headers, retries=1)
+            response.raise_for_status()
+        except requests.exceptions.RequestException:
+            pass
+        else:
+            sha = response.text.strip()
+            if re.fullmatch(r'[0-9a-f]{40}', sha):
+                return sha
+    return ls_remote_commit(repo_url, ref)
+
+
+def ls_remote_commit(repo_url: str, ref: str) -> str | None:
+    """
+    Resolves a branch or tag of a remote git repository with `git ls-remote`, preferring branches and
+    peeling annotated tags. A full commit SHA is returned as is. Returns None when it cannot be resolved.
+    """
+    if re.fullmatch(r'[0-9a-f]{40}', ref):
+        return ref
+    if not repo_url.startswith(("https://", "http://", "git://", "ssh://", "file://")):
+        return None
+    try:
+        result = subprocess.run(["git", "ls-remote", repo_url, f"refs/heads/{ref}", f"refs/tags/{ref}",
+                                 f"refs/tags/{ref}^{{}}"], capture_output=True, text=True, check=True,
+                                timeout=HTTP_CONNECT_TIMEOUT + HTTP_READ_TIMEOUT,
+                                env={**os.environ, "GIT_TERMINAL_PROMPT": "0"})
+    except (OSError, subprocess.SubprocessError):
+        return None
+    refs = dict(reversed(line.split("\t", 1)) for line in result.stdout.splitlines() if "\t" in line)
+    for name in (f"refs/heads/{ref}", f"refs/tags/{ref}^{{}}", f"refs/tags/{ref}"):
+        if re.fullmatch(r'[0-9a-f]{40}', refs.get(name, "")):
+            return refs[name]
+    return None
+
+
+def _github_repository_size(owner: str, repo: str) -> int | None:
+    headers = {"Authorization": f"Bearer {GITHUB_TOKEN}"} if GITHUB_TOKEN else {}
+    try:
+        response = http_client.get(f"https://api.github.com/repos/{owner}/{repo}", headers=headers, retries=1)
+        response.raise_for_status()
+        return int(response.json()["size"]) * 1024
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+        return None
+
+
+def repository_size(repo_url: str) -> int | None:
+    """
+    Returns the size of a GitHub repository in bytes as reported by the GitHub API, or None if unknown.
+    Sizes are reused for LOOKUP_CACHE_SECONDS, like resolved refs.
+    """
+    match = re.search(r'github\.com[/:]([^/]+)/([^/]+?)(?:\.git)?/?$', repo_url)
+    if not match:
+        return None
+    owner, repo = match.groups()
+    return lookup_cache.get(("size", owner, repo), lambda: _github_repository_size(owner, repo))
+
+
+# --- Repository Sources ---
+# Files are read through a RepositorySource (see sources.py): a downloaded zip archive, or a git repository on
+# disk (a local clone, a file:// URL or a bare mirror). With a mirror pool, remote repositories are fetched
+# shallow and without blobs; only the blobs of files that pass the filters are fetched afterwards.
+
+def local_repository_path(repo_url: str) -> str | None:
+    """
+    Returns the directory of a repository given as a local path or file:// URL, or None for remote URLs.
+    download_and_process_repo only reads such directories with allow_local (see ALLOW_LOCAL_SOURCES).
+    """
+    if repo_url.startswith("file://"):
+        return urllib.parse.unquote(urllib.parse.urlparse(repo_url).path)
+    if "://" not in repo_url and os.path.isdir(os.path.expanduser(repo_url)):
+        return os.path.expanduser(repo_url)
+    return None
+
+
+class MirrorPool:
+    """
+    Bare partial mirrors of remote repositories under root, one per repository URL.
+    Each run fetches only the requested commit, at depth 1 and without blobs; GitSource.prefetch then fetches
+    the blobs of the files that pass the filters. Runs on the same mirror are serialized while fetching.
+    download_and_process_repo uses mirror_pool unless given a pool, and downloads the archive if the fetch fails.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self._locks: dict[Path, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def path_for(self, repo_url: str) -> Path:
+        parsed = urllib.parse.urlparse(repo_url)
+        name = f"{parsed.hostname}/{parsed.path.strip('/').removesuffix('.git')}"
+        return self.root / (re.sub(r'[^\w.-]+', "_", name.replace("/", "__")) + ".git")
+
+    def checkout(self, repo_url: str, ref: str, log: ProgressLog) -> GitSource:
+        """Fetches ref (a branch, tag or commit) into the mirror of repo_url and opens it."""
+        path = self.path_for(repo_url)
+        with self._locks_lock:
+            lock = self._locks.setdefault(path, threading.Lock())
+        with lock:
+            if not (path / "HEAD").is_file():
+                path.mkdir(parents=True, exist_ok=True)
+                run_git(path, "init", "--bare", "--quiet")
+                run_git(path, "remote", "add", "origin", repo_url)
+                run_git(path, "config", "remote.origin.promisor", "true")
+                run_git(path, "config", "remote.origin.partialclonefilter", "blob:none")
+                log.push(f"🪞 Created mirror {path.name}.")
+            started = time.monotonic()
+            try:
+                run_git(path, "fetch", "--quiet", "--no-tags", "--depth=1", "--filter=blob:none", "origin",
+                        "--end-of-options", ref)
+                commit = run_git(path, "rev-parse", "--verify", "FETCH_HEAD^{commit}").strip()
+            except SourceError as e:
+                # A commit or branch fetched before can still be served while the remote is unreachable; fetches
+                # keep no tags, and update branches only as the remote-tracking refs/remotes/origin/<branch>
+                log.push(f"⚠️ Mirror fetch failed ({e}); trying the mirror's copy.", LOG_WARNING)
+                for name in (f"refs/remotes/origin/{ref}", ref):
+                    try:
+                        return GitSource.open(str(path), name)
+                    except SourceError:
+                        pass
+                raise SourceError(f"Cannot fetch {ref!r} and the mirror has no copy of it: {e}")
+        log.push(f"🪞 Fetched {ref} into mirror {path.name} in {time.monotonic() - started:.2f} s.")
+        return GitSource(str(path), commit)
+
+
+mirror_pool = MirrorPool(MIRROR_DIR) if MIRROR_DIR else None
+
+
+# --- Parallel File Processing ---
+# Decoding and AST-based test detection are CPU-bound, so large repositories are spread over worker processes.
+# Workers run sources.process_entry_batch on batches of file paths; results come back in submission order,
+# which keeps the output identical to serial processing.
+
+_process_pool: ProcessPoolExecutor | None = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Returns the shared process pool, recreating it if a different worker count is requested."""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            # Spawned workers are safe to start from the threads NiceGUI runs jobs on
+            _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _process_pool_workers = workers
+        return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    """Shuts the shared process pool down, waiting for its workers to exit."""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+            _process_pool, _process_pool_workers = None, 0
+
+
+atexit.register(shutdown_process_pool)
+
+
+def iter_entries_parallel(source: RepositorySource, entries: list[tuple[str, str]], workers: int,
+                          batch_size: int = PARALLEL_BATCH_SIZE, mode: str = "full",
+                          imports: bool = False) -> Iterator[tuple[str, str, str | None, list[str] | None]]:
+    """Yields process_archive_entry results for (file path, language) entries, in order, computed on the process pool."""
+    batches = [entries[i:i + batch_size] for i in range(0, len(entries), batch_size)]
+    with source.shared() as spec:
+        pool = get_process_pool(workers)
+        for batch_results in pool.map(process_entry_batch, [spec] * len(batches), batches,
+                                      [mode] * len(batches), [imports] * len(batches)):
+            yield from batch_results
 
 
 # --- Core Processing Logic (Adapted for UI Integration) ---
 
-def download_and_process_repo(repo_url: str, branch_or_tag: str, log: ui.log) -> tuple[str | None, str]:
+def download_and_process_repo(repo_url: str, branch_or_tag: str, log: ProgressLog,
+                              sink: OutputSink | None = None, max_tokens: int | None = None,
+                              priority: str = "order", manifests: ManifestStore | None = None,
+                              include: Iterable[str] = (), exclude: Iterable[str] = (),
+                              languages: Iterable[str] = ("python",), mode: str = "full",
+                              dedupe: bool = False, mirrors: MirrorPool | None = None,
+                              allow_local: bool = ALLOW_LOCAL_SOURCES,
+                              order: str = "archive") -> tuple[OutputSink | None, str]:
     """
-    Downloads and processes files from a GitHub repository, logging progress to the UI.
-    Returns a tuple of (concatenated content as string or None on failure, repository name).
+    Fetches a repository at branch_or_tag and writes its processed files to sink (a StringSink by default),
+    taking filter, mode and order options as iter_output_chunks and write_staged_output do.
+    Returns a tuple of (the output, possibly from result_cache, or None on failure, repository name).
     """
     repo_name = get_repo_name_from_url(repo_url)
-    download_url = f"{repo_url}/archive/refs/heads/{branch_or_tag}.zip"
-    lang = "python"
+    filter_settings = {"languages": list(languages), "include": list(include), "exclude": list(exclude),
+                       "mode": mode, "dedupe": dedupe}
+    output_settings = {"format": "txt", "max_tokens": max_tokens, "priority": priority if max_tokens else None,
+                       "order": order}
+    needs_index = order != "archive" or bool(max_tokens) and priority == "central"
+
+    timings = StageTimings(MemorySampler())
+    source: RepositorySource | None = None
+    local_path = local_repository_path(repo_url)
+
+    with timings.stage("resolve"):
+        if local_path is not None:
+            try:
+                if not allow_local:
+                    raise SourceError("Reading repositories from the server's filesystem is disabled.")
+                source = GitSource.open(local_path, branch_or_tag)
+            except SourceError as e:
+                log.push(f"❌ Error: {e}", LOG_WARNING)
+                if sink is not None:
+                    sink.close()
+                timings.finish(log, "failed")
+                return None, repo_name
+            commit_sha = source.commit
+        else:
+            commit_sha = resolve_commit_sha(repo_url, branch_or_tag)
+    cache_key = index_key = index = None
+
+    def lookup_cache() -> OutputSink | None:
+        """Computes the cache and import index keys for commit_sha and returns the cached output, if any."""
+        nonlocal cache_key, index_key, index
+        log.push(f"🔖 Resolved {branch_or_tag} to commit {commit_sha[:12]}")
+        cache_key = make_cache_key(repo_url, commit_sha, branch_or_tag, filter_settings, json.dumps(output_settings))
+        with timings.stage("cache"):
+            cached = result_cache.get(cache_key)
+        if cached is not None:
+            if sink is not None:
+                sink.close()
+            if source is not None:
+                source.close()
+            log.push(f"⚡ Served from cache ({cached.size_bytes / 1024:.1f} KB). Cache stats: {result_cache.stats()}")
+            timings.finish(log, "cached")
+            return cached
+        if needs_index:
+            index_key = make_cache_key(repo_url, commit_sha, "", filter_settings, "import-index")
+            with timings.stage("cache"):
+                index = result_cache.get_index(index_key)
+            if index is not None:
+                log.push("🧭 Reusing the cached import index.", LOG_DETAIL)
+        return None
+
+    if commit_sha and (cached := lookup_cache()) is not None:
+        return cached, repo_name
 
-    log.push(f"🔄 Attempting to download from: {download_url}")
+    if mirrors is None:
+        mirrors = mirror_pool
+    if source is None and mirrors is not None and repo_url.startswith(("https://", "http://")):
+        try:
+            with timings.stage("download"):
+                source = mirrors.checkout(repo_url, commit_sha or branch_or_tag, log)
+        except SourceError as e:
+            log.push(f"⚠️ Mirror unavailable ({e}); downloading the archive instead.", LOG_WARNING)
+        else:
+            # Hosts other than GitHub are only resolved by the mirror fetch
+            if not commit_sha:
+                commit_sha = source.commit
+                if (cached := lookup_cache()) is not None:
+                    return cached, repo_name
+
+    if source is None:
+        # Download the exact commit when it is known, so the cached output matches its key
+        if commit_sha:
+            download_url = f"{repo_url.rstrip('/')}/archive/{commit_sha}.zip"
+        else:
+            download_url = f"{repo_url}/archive/refs/heads/{branch_or_tag}.zip"
+        log.push(f"🔄 Attempting to download from: {download_url}")
+        try:
+            with timings.stage("download"):
+                archive = fetch_archive(download_url, log)
+        except requests.exceptions.RequestException as e:
+            log.push(f"❌ Error: Failed to download the repository. {e}", LOG_WARNING)
+            if sink is not None:
+                sink.close()
+            timings.finish(log, "failed")
+            return None, repo_name
+        timings.count("archive_bytes", archive.seek(0, os.SEEK_END))
+        archive.seek(0)
+        source = ZipSource(zipfile.ZipFile(archive), archive)
+        log.push("✅ Download successful. Processing files...")
+    else:
+        log.push(f"📂 Reading commit {source.commit[:12]} from {source.git_dir}. Processing files...")
+
+    if sink is None:
+        sink = StringSink()
+    if manifests is None:
+        manifests = manifest_store
+    # Without the encoder the output is still written, only uncounted, so it is neither budgeted nor cached
+    encoder_error = token_counter.load_error()
+    count_tokens = encoder_error is None
+    if not count_tokens:
+        log.push(f"⚠️ Token encoder unavailable ({encoder_error}); the output is not token counted, budgeted or "
+                 "cached.", LOG_WARNING)
+        max_tokens = cache_key = None
+    # A failed git read (say, a blob fetch that loses the network) or token count fails the job before the
+    # manifest is saved or the output cached
     try:
-        response = requests.get(download_url, timeout=30)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        log.push(f"❌ Error: Failed to download the repository. {e}")
+        with source, (manifests.open(repo_url, branch_or_tag, filter_settings) if manifests else nullcontext()) \
+                as manifest:
+            report = CompressionReport(manifest=manifest) if (mode != "full" or dedupe) and count_tokens else None
+            imports = {} if needs_index and index is None else None
+            chunks = iter_output_chunks(source, repo_url, branch_or_tag, log, manifest=manifest, timings=timings,
+                                        report=report, imports=imports, **filter_settings)
+            if max_tokens or order != "archive":
+                write_staged_output(chunks, sink, log, max_tokens, priority, order, imports, index, manifest,
+                                    timings, count_tokens)
+            else:
+                write_output(chunks, sink, manifest=manifest, timings=timings, count_tokens=count_tokens)
+
+            # Finished before the manifest is saved, so the last uncompressed counts are recorded in it
+            if report is not None:
+                with timings.stage("tokenize"):
+                    report.finish(sink)
+                timings.count("tokens_saved", report.mode_tokens + report.duplicate_tokens)
+                log.push(report.summary(mode, dedupe))
+    except (SourceError, OSError, TokenCountError) as e:
+        log.push(f"❌ Error: {e}", LOG_WARNING)
+        sink.close()
+        timings.finish(log, "failed")
         return None, repo_name
 
-    log.push("✅ Download successful. Processing files...")
-    zip_file = zipfile.ZipFile(io.BytesIO(response.content))
-    
+    largest = sorted(sink.files, key=lambda f: f.token_count or 0, reverse=True)[:5]
+    if largest and count_tokens:
+        breakdown = ", ".join(f"{f.path} ({f.token_count:,})" for f in largest)
+        log.push(f"🔢 {sink.token_count:,} tokens in total. Largest files: {breakdown}")
+
+    if cache_key is not None:
+        with timings.stage("cache"):
+            result_cache.put(cache_key, sink)
+            if index_key is not None and index is None and sink.import_index is not None:
+                result_cache.put_index(index_key, sink.import_index)
+        log.push(f"💾 Stored in cache. Cache stats: {result_cache.stats()}")
+
+    timings.finish(log, "done")
+    return sink, repo_name
+
+
+class CompressionReport:
+    """
+    Tokens an output mode and duplicate skipping remove from an output.
+    The uncompressed chunks of compressed and skipped files are counted in batches while the output is
+    written, and compared with the per-file counts of the finished output. The counts are recorded in
+    manifest, so files restored from it on later runs are reported without their uncompressed text.
+    """
+
+    def __init__(self, counter: TokenCounter | None = None, batch_size: int = TOKEN_BATCH_SIZE,
+                 manifest: FileManifest | None = None):
+        self.counter = counter or token_counter
+        self.batch_size = batch_size
+        self.manifest = manifest
+        self.original_tokens: dict[str, int] = {}  # path -> tokens of the uncompressed chunk
+        self.mode_tokens = 0                       # tokens saved by the output mode (set by finish)
+        self.duplicate_tokens = 0                  # tokens of the skipped duplicate files
+        self.duplicates = 0
+        self._pending: list[tuple[str, str, bool, bool]] = []  # (path, chunk, duplicate, compressed)
+
+    def add(self, file_path: str, chunk: str | None, duplicate: bool = False, compressed: bool = True,
+            tokens: int | None = None) -> None:
+        """
+        Records the uncompressed chunk of a file the output mode compressed, or of a duplicate left out of the
+        output (compressed or not). tokens, the count recorded in the manifest by an earlier run, replaces chunk.
+        """
+        self.duplicates += duplicate
+        if tokens is not None:
+            self._account(file_path, tokens, duplicate)
+            return
+        self._pending.append((file_path, chunk, duplicate, compressed))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        counts = self.counter.count_batch([chunk for _, chunk, _, _ in self._pending]) if self._pending else []
+        for (file_path, _, duplicate, compressed), count in zip(self._pending, counts):
+            self._account(file_path, count, duplicate)
+            if compressed and self.manifest is not None:
+                self.manifest.set_original_tokens(file_path, count)
+        self._pending.clear()
+
+    def _account(self, file_path: str, tokens: int, duplicate: bool) -> None:
+        if duplicate:
+            self.duplicate_tokens += tokens
+        else:
+            self.original_tokens[file_path] = tokens
+
+    def finish(self, output: OutputSink) -> None:
+        """Counts the remaining chunks and computes mode_tokens from the token counts of output."""
+        self.flush()
+        counts = {f.path: f.token_count for f in output.files + output.omitted_files}
+        self.mode_tokens = sum(tokens - counts[file_path] for file_path, tokens in self.original_tokens.items()
+                               if counts.get(file_path) is not None)
+
+    def summary(self, mode: str, dedupe: bool) -> str:
+        parts = []
+        if mode != "full":
+            parts.append(f"output mode {mode!r} saved {self.mode_tokens:,} tokens over {len(self.original_tokens)} files")
+        if dedupe:
+            parts.append(f"skipping {self.duplicates} duplicate files saved {self.duplicate_tokens:,} tokens")
+        return f"🗜️ Compression: {'; '.join(parts)}."
+
+
+def write_output(chunks: Iterable[tuple[str | None, str]], sink: OutputSink,
+                 counter: TokenCounter | None = None, batch_size: int = TOKEN_BATCH_SIZE,
+                 manifest: FileManifest | None = None, timings: StageTimings | None = None,
+                 count_tokens: bool = True) -> OutputSink:
+    """
+    Writes (file path, chunk) pairs to sink and counts their tokens in batches as they arrive,
+    filling in the per-file token counts of sink.files and the total sink.token_count.
+    Chunk boundaries coincide with token boundaries, so the total equals counting the concatenated text.
+    Files whose count is already in manifest are not tokenized again; new counts are recorded there.
+    Without count_tokens the chunks are only written, and the counts are left as None.
+    Time spent tokenizing and writing is added to the "tokenize" and "write" stages of timings.
+    """
+    counter = counter or token_counter
+    timings = timings or StageTimings()
+    pending: list[tuple[OutputFile | None, str]] = []
+    total = 0
+
+    def flush():
+        nonlocal total
+        with timings.stage("tokenize"):
+            counts = counter.count_batch([chunk for _, chunk in pending])
+        for (entry, _), count in zip(pending, counts):
+            if entry is not None:
+                entry.token_count = count
+                if manifest is not None:
+                    manifest.set_tokens(entry.path, count)
+            total += count
+        pending.clear()
+
+    for file_path, chunk in chunks:
+        with timings.stage("write"):
+            sink.write(chunk, file_path)
+        if not count_tokens:
+            continue
+        known = manifest.known_tokens(file_path) if manifest is not None and file_path is not None else None
+        if known is not None:
+            sink.files[-1].token_count = known
+            total += known
+            continue
+        pending.append((sink.files[-1] if file_path is not None else None, chunk))
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    sink.token_count = total if count_tokens else None
+    return sink
+
+
+def write_staged_output(chunks: Iterable[tuple[str | None, str]], sink: OutputSink, log: ProgressLog,
+                        max_tokens: int | None = None, priority: str = "order", order: str = "archive",
+                        imports: dict[str, list[str]] | None = None, index: dict | None = None,
+                        manifest: FileManifest | None = None, timings: StageTimings | None = None,
+                        count_tokens: bool = True) -> OutputSink:
+    """
+    Writes the files in the given order (one of OUTPUT_ORDERS) and, with max_tokens set, only as many of them
+    as fit in max_tokens, taking them in priority order and skipping any file that does not fit in the
+    remaining budget. Kept files stay in output order.
+    Orders other than "archive" and the "central" priority use the import index: index if given, else one
+    built from imports ({path: imported names} as filled by iter_output_chunks), else one built by parsing
+    the staged files. The index used is stored on sink.import_index so it can be cached.
+    Every file is tokenized exactly once: the chunks are staged with their per-file counts, and the
+    selection is made from those counts without encoding the output again. Without count_tokens the files
+    are only ordered, and max_tokens must not be set.
+    """
+    timings = timings or StageTimings()
+    staging = write_output(chunks, TempFileSink(), manifest=manifest, timings=timings, count_tokens=count_tokens)
+    try:
+        files = staging.files
+        if order != "archive" or max_tokens and priority == "central":
+            with timings.stage("order"):
+                if index is None:
+                    if imports is None:
+                        imports = {f.path: sorted(file_imports(f.path, staging.read_file(f))) for f in files}
+                    index = build_import_index(imports)
+                sink.import_index = index
+                if order != "archive":
+                    rank = {path: i for i, path in enumerate(index[order])}
+                    files = sorted(files, key=lambda f: rank.get(f.path, len(rank)))
+
+        if max_tokens:
+            header_tokens = staging.token_count - sum(f.token_count for f in files)
+            with timings.stage("budget"):
+                selected, omitted = select_files_within_budget(staging, max_tokens - header_tokens, priority,
+                                                               files, index)
+        else:
+            selected, omitted = {f.path for f in files}, []
+
+        sink.write(staging.read_header())
+        for entry in files:
+            if entry.path in selected:
+                sink.write(staging.read_file(entry), entry.path)
+                sink.files[-1].token_count = entry.token_count
+        if count_tokens:
+            sink.token_count = staging.token_count - sum(f.token_count for f in omitted)
+        sink.omitted_files = omitted
+    finally:
+        staging.close()
+
+    if order != "archive":
+        log.push(f"🧭 Ordered {len(files)} files: {OUTPUT_ORDERS[order].lower()}.")
+    if max_tokens:
+        log.push(f"🎯 Token budget {max_tokens:,} ({priority}): kept {len(sink.files)} files, "
+                 f"{sink.token_count:,} tokens; left out {len(omitted)} files, "
+                 f"{sum(f.token_count for f in omitted):,} tokens.")
+        for entry in omitted:
+            log.push(f"✂️ Left out (over budget): {entry.path} ({entry.token_count:,} tokens)", LOG_DETAIL)
+    return sink
+
+
+class ArchiveTooLargeError(requests.exceptions.RequestException):
+    """Raised when a repository archive exceeds MAX_ARCHIVE_BYTES."""
+
+
+def fetch_archive(download_url: str, log: ProgressLog, spool_threshold: int = ARCHIVE_SPOOL_THRESHOLD,
+                  max_bytes: int = MAX_ARCHIVE_BYTES, client: HttpClient | None = None,
+                  cache: ArchiveCache | None = None) -> BinaryIO:
+    """
+    Streams the archive at download_url into a spooled buffer.
+    The buffer stays in memory up to spool_threshold bytes and spills to a temporary file beyond that,
+    so large repositories never need to be held in RAM in full. Archives over max_bytes are rejected.
+    With an archive cache (archive_cache by default) the download goes to disk instead, and a cached copy
+    is revalidated with If-None-Match so unchanged archives are not downloaded again.
+    client.get retries failed requests; transfers interrupted mid-stream are retried here, up to client.retries times.
+    """
+    client = client or http_client
+    cache = cache if cache is not None else archive_cache
+    cached = cache.lookup(download_url) if cache is not None else None
+    if cached is not None and re.search(r'/archive/[0-9a-f]{40}\.zip$', download_url):
+        log.push("📦 Using cached archive of this commit.")
+        cache.touch(download_url)
+        return open(cached[0], "rb")
+    headers = {"If-None-Match": cached[1]} if cached is not None and cached[1] else None
+
+    for attempt in range(client.retries + 1):
+        archive = cache.new_download() if cache is not None else tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+        downloaded = 0
+        started = time.monotonic()
+        streaming = False
+        try:
+            with client.get(download_url, headers=headers, stream=True) as response:
+                first_byte = time.monotonic() - started
+                if response.status_code == 304 and cached is not None:
+                    archive.close()
+                    os.unlink(archive.name)
+                    client.record_not_modified()
+                    log.push(f"📦 Archive not modified since last download (first byte after {first_byte * 1000:.0f} ms).")
+                    cache.touch(download_url)
+                    return open(cached[0], "rb")
+                response.raise_for_status()
+                if int(response.headers.get("Content-Length") or 0) > max_bytes:
+                    raise ArchiveTooLargeError(f"Archive is larger than the {max_bytes // (1024 * 1024)} MB limit.")
+                streaming = True
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    archive.write(chunk)
+                    downloaded += len(chunk)
+                    if downloaded > max_bytes:
+                        raise ArchiveTooLargeError(f"Archive is larger than the {max_bytes // (1024 * 1024)} MB limit.")
+                etag = response.headers.get("ETag", "")
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError) as e:
+            # Errors before the body (connection refused, retryable statuses) were already retried by client.get;
+            # a read timeout while streaming surfaces as a ConnectionError
+            _discard_download(archive, cache)
+            if not streaming or attempt == client.retries:
+                raise
+            log.push(f"🔁 Download interrupted ({e}), retrying...", LOG_WARNING)
+            client.wait_before_retry(attempt)
+            continue
+        except Exception:
+            _discard_download(archive, cache)
+            raise
+        break
+
+    elapsed = time.monotonic() - started
+    client.record_download(downloaded, elapsed)
+    rate = downloaded / elapsed / (1024 * 1024) if elapsed > 0 else 0.0
+    if cache is not None:
+        location = "archive cache"
+        archive = open(cache.store(download_url, archive, etag), "rb")
+    else:
+        location = "temporary file" if downloaded > spool_threshold else "memory"
+        archive.seek(0)
+    log.push(f"📦 Downloaded {downloaded / 1024:.1f} KB in {elapsed:.2f} s ({rate:.2f} MB/s, "
+             f"first byte after {first_byte * 1000:.0f} ms, buffered in {location}).")
+    return archive
+
+
+def _discard_download(archive: BinaryIO, cache: ArchiveCache | None) -> None:
+    archive.close()
+    if cache is not None:
+        Path(archive.name).unlink(missing_ok=True)
+
+
+def iter_output_chunks(source: RepositorySource | zipfile.ZipFile, repo_url: str, branch_or_tag: str, log: ProgressLog,
+                       languages: Iterable[str] = ("python",), workers: int | None = None,
+                       manifest: FileManifest | None = None, include: Iterable[str] = (),
+                       exclude: Iterable[str] = (), mode: str = "full", dedupe: bool = False,
+                       timings: StageTimings | None = None, report: CompressionReport | None = None,
+                       imports: dict[str, list[str]] | None = None) -> Iterator[tuple[str | None, str]]:
+    """
+    Filters the files of a repository source (a zip archive is read as a ZipSource) and yields the concatenated
+    output as (file path, chunk) pairs: first the metadata header (with no path), then one chunk per processed file.
+    A single pass over the file list routes every file to the handler of its language (by extension),
+    so polyglot repositories need only one download. Only the files that pass the filters are read, and
+    source.prefetch fetches them up front where the source is a partial clone.
+    Decoding and test detection run on a process pool of `workers` processes (PARALLEL_WORKERS by default);
+    output order and log messages do not depend on the worker count.
+    With a manifest, files unchanged since its last run are taken from it without being read.
+    include and exclude are gitignore-style globs narrowing the built-in path filter.
+    Files are compressed according to mode (one of OUTPUT_MODES) by their language handler, and with dedupe
+    a file whose output is identical to an earlier one (e.g. a vendored copy) is skipped. The uncompressed
+    text of compressed and skipped files is passed to report so the tokens saved can be counted.
+    A given imports dict is filled with the modules every output file imports, in output order, taken from
+    the parse that test detection already makes (see build_import_index).
+    Time spent filtering paths, prefetching and extracting files (decompression, decoding, test detection) is
+    added to the "filter", "fetch" and "extract" stages of timings, along with per-outcome file counters.
+    """
+    timings = timings or StageTimings()
+    if isinstance(source, zipfile.ZipFile):
+        source = ZipSource(source)
+
     # Add header with metadata
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    file_contents = f"""# ========================================
+    yield None, f"""# ========================================
 # Repository: {repo_url}
 # Branch/Tag: {branch_or_tag}
 # Processed: {timestamp}
@@ -288,36 +2331,573 @@ def download_and_process_repo(repo_url: str, branch_or_tag: str, log: ui.log) ->
 
 """
 
-    all_files = zip_file.namelist()
-    log.push(f"📊 Found {len(all_files)} total files in the archive.")
+    all_files = source.list_files()
+    log.push(f"📊 Found {len(all_files)} total files in the repository.")
+
+    routes = extension_map(languages)
+    path_filters = {lang: get_path_filter(lang, include, exclude) for lang in set(routes.values())}
+    candidates: dict[str, str] = {}
+    considered = 0
+    with timings.stage("filter"):
+        for file_path in all_files:
+            considered += 1
+            lang = language_for_path(file_path, routes)
+            if lang is None or not path_filters[lang](file_path):
+                continue
+            candidates[file_path] = lang
+    timings.count("files_considered", considered)
+    timings.count("files_filtered", considered - len(candidates))
+
+    if len(path_filters) > 1:
+        per_language = dict.fromkeys(routes.values(), 0)
+        for lang in candidates.values():
+            per_language[lang] += 1
+        breakdown = ", ".join(f"{lang} ({count})" for lang, count in per_language.items())
+        log.push(f"🗂️ Candidate files by language: {breakdown}")
+
+    unchanged = {}
+    if manifest is not None:
+        for file_path in candidates:
+            entry = manifest.lookup(file_path, source.version(file_path))
+            if entry is not None:
+                unchanged[file_path] = entry
+    changed = [(file_path, lang) for file_path, lang in candidates.items() if file_path not in unchanged]
+    with timings.stage("fetch"):
+        fetched = source.prefetch(file_path for file_path, _ in changed)
+    if fetched:
+        log.push(f"📥 Fetched {fetched} file contents for the selected files.")
+
+    if workers is None:
+        workers = PARALLEL_WORKERS
+    if workers > 1 and len(changed) >= PARALLEL_MIN_FILES:
+        results = iter_entries_parallel(source, changed, workers, mode=mode, imports=imports is not None)
+    else:
+        results = (process_archive_entry(source, file_path, lang, mode, imports is not None)
+                   for file_path, lang in changed)
 
     processed_count = 0
-    for file_path in all_files:
-        cleaned_path = "/".join(file_path.split('/')[1:])
-        if not cleaned_path or file_path.endswith("/"):
-            continue
+    seen: dict[bytes, str] = {}  # content hash -> first path with that output
+    log.progress(0, len(candidates))
+    for done, file_path in enumerate(candidates, 1):
+        log.progress(done, len(candidates))
+        with timings.stage("extract"):
+            if file_path in unchanged:
+                status, payload, imported = manifest.restore(file_path, unchanged[file_path])
+                original, original_tokens = None, manifest.original_tokens(file_path)
+            else:
+                status, payload, original, imported = next(results)
+                original_tokens = None
+                if manifest is not None:
+                    manifest.record(file_path, source.version(file_path), status, payload, imported)
 
-        if not is_file_type(cleaned_path, ".py") or not is_likely_useful_file(cleaned_path, lang):
+        if status == "error":
+            log.push(f"⚠️ Skipping (read/decode error): {file_path} - {payload}", LOG_WARNING)
+            timings.count("files_error")
             continue
 
-        try:
-            file_content = zip_file.read(file_path).decode("utf-8")
-        except (UnicodeDecodeError, Exception) as e:
-            log.push(f"⚠️ Skipping (read/decode error): {cleaned_path} - {e}")
+        if status == "test":
+            log.push(f"🧪 Skipping (test file): {file_path}", LOG_DETAIL)
+            timings.count("files_test")
             continue
 
-        if is_test_file(file_content, lang):
-            log.push(f"🧪 Skipping (test file): {cleaned_path}")
-            continue
+        if dedupe:
+            digest = hashlib.blake2b(payload.encode("utf-8"), digest_size=16).digest()
+            if digest in seen:
+                log.push(f"♊ Skipping (duplicate of {seen[digest]}): {file_path}", LOG_DETAIL)
+                timings.count("files_duplicate")
+                if report is not None:
+                    report.add(file_path, f"# File: {file_path}\n{original or payload}\n\n", duplicate=True,
+                               compressed=original is not None, tokens=original_tokens)
+                continue
+            seen[digest] = file_path
 
-        log.push(f"📄 Processing: {cleaned_path}")
-        file_contents += f"# File: {cleaned_path}\n"
-        file_contents += file_content
-        file_contents += "\n\n"
+        if report is not None and (original is not None or original_tokens is not None):
+            report.add(file_path, f"# File: {file_path}\n{original}\n\n" if original is not None else None,
+                       tokens=original_tokens)
+        if imports is not None:
+            # Entries recorded without imports: every output mode keeps the import statements
+            imports[file_path] = imported if imported is not None else sorted(file_imports(file_path, payload))
+        log.push(f"📄 Processing: {file_path}", LOG_DETAIL)
+        yield file_path, f"# File: {file_path}\n{payload}\n\n"
         processed_count += 1
+    timings.count("files_processed", processed_count)
 
     log.push(f"✨ Processing complete. Processed {processed_count} files.")
-    return file_contents, repo_name
+    if manifest is not None:
+        log.push(f"♻️ Incremental: reused {manifest.reused} unchanged files, "
+                 f"processed {manifest.processed} new or changed files.")
+
+
+# --- Job Scheduler ---
+# Processing requests from the UI and the REST API run as jobs on a fixed set of worker threads.
+# Waiting jobs sit in a bounded FIFO queue, a job only starts while its memory estimate fits in the shared
+# budget, and identical requests made while a job is queued or running attach to that job instead of
+# starting another one.
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    """A scheduled unit of work. Progress messages are recorded and fanned out to every subscribed log."""
+
+    def __init__(self, key: str, work: Callable[[ProgressLog], object], memory_estimate: int,
+                 size: int | None = None):
+        self.key = key
+        self.work = work
+        self.memory_estimate = memory_estimate
+        self.size = size  # of the repository, if known
+        self.future: Future = Future()
+        self.state = "queued"
+        self.submitted_at = time.monotonic()
+        self.started_at: float | None = None
+        # Replayed to logs that subscribe later; bounded like BatchedLog.messages
+        self.messages: deque[tuple[str, int]] = deque(maxlen=LOG_HISTORY_LINES)
+        self.latest_progress: tuple[int, int] | None = None
+        self._logs: list[ProgressLog] = []
+        self._lock = threading.Lock()
+
+    def push(self, message: str, level: int = LOG_INFO) -> None:
+        with self._lock:
+            self.messages.append((message, level))
+            logs = list(self._logs)
+        for log in logs:
+            log.push(message, level)
+
+    def progress(self, done: int, total: int) -> None:
+        with self._lock:
+            self.latest_progress = (done, total)
+            logs = list(self._logs)
+        for log in logs:
+            log.progress(done, total)
+
+    def subscribe(self, log: ProgressLog) -> None:
+        """Attaches a log, replaying the messages and progress it missed."""
+        with self._lock:
+            for message, level in self.messages:
+                log.push(message, level)
+            if self.latest_progress is not None:
+                log.progress(*self.latest_progress)
+            self._logs.append(log)
+
+    def unsubscribe(self, log: ProgressLog) -> None:
+        with self._lock:
+            if log in self._logs:
+                self._logs.remove(log)
+
+
+class JobMemoryModel:
+    """
+    Estimates the memory a job holds from the size of its repository (see repository_size): the size times
+    an expansion factor, plus a fixed overhead. The factor starts at `expansion` and moves towards the ratio of
+    peak RSS growth (measured with MemorySampler) to size of each finished job.
+    """
+
+    # Repositories smaller than this are not measured: their growth is mostly noise from other jobs
+    MIN_MEASURED_SIZE = 1024 * 1024
+
+    def __init__(self, expansion: float = JOB_MEMORY_EXPANSION, overhead: int = JOB_MEMORY_OVERHEAD,
+                 unknown: int = JOB_MEMORY_ESTIMATE):
+        self.expansion = expansion
+        self.overhead = overhead
+        self.unknown = unknown
+        self._lock = threading.Lock()
+
+    def estimate(self, size: int | None) -> int:
+        """Returns the memory to charge for a repository of size bytes, or `unknown` when size is None."""
+        if size is None:
+            return self.unknown
+        with self._lock:
+            return self.overhead + int(size * self.expansion)
+
+    def observe(self, size: int | None, growth_bytes: float) -> None:
+        """Records the peak RSS growth of a finished job for a repository of size bytes."""
+        if size is None or size < self.MIN_MEASURED_SIZE:
+            return
+        # Memory freed by earlier jobs is reused without growing RSS, so a single low reading counts for little
+        with self._lock:
+            self.expansion = max(1.0, 0.7 * self.expansion + 0.3 * max(growth_bytes - self.overhead, 0) / size)
+
+
+class JobScheduler:
+    """Runs jobs on `workers` threads with a bounded queue, memory admission control and deduplication."""
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_SIZE,
+                 memory_budget: int = JOB_MEMORY_BUDGET, memory_model: JobMemoryModel | None = None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.memory_budget = memory_budget
+        self.memory_model = memory_model or JobMemoryModel()
+        self._queue: deque[Job] = deque()
+        self._inflight: dict[str, Job] = {}
+        self._running: list[Job] = []
+        self._memory_in_use = 0
+        self._condition = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        # Exponentially weighted average job duration, for ETAs
+        self._average_duration: float | None = None
+        self.counters = {"submitted": 0, "deduplicated": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    def submit(self, key: str, work: Callable[[ProgressLog], object], log: ProgressLog | None = None,
+               size: int | None = None) -> Job:
+        """
+        Queues work(log) under key, or returns the queued/running job with the same key. size, the size of
+        the repository if known, sets the memory the job is charged (see JobMemoryModel).
+        Raises QueueFullError when the queue is at capacity.
+        """
+        with self._condition:
+            job = self._inflight.get(key)
+            if job is not None:
+                self.counters["deduplicated"] += 1
+            else:
+                if len(self._queue) >= self.max_queue:
+                    self.counters["rejected"] += 1
+                    raise QueueFullError(f"The job queue is full ({self.max_queue} waiting). Please try again later.")
+                job = Job(key, work, self.memory_model.estimate(size), size)
+                self._queue.append(job)
+                self._inflight[key] = job
+                self.counters["submitted"] += 1
+                self._start_workers()
+                self._condition.notify()
+            if log is not None:
+                job.subscribe(log)
+            return job
+
+    def position(self, job: Job) -> int | None:
+        """Returns the 1-based queue position of a waiting job, or None once it has started."""
+        with self._condition:
+            try:
+                return self._queue.index(job) + 1
+            except ValueError:
+                return None
+
+    def eta(self, job: Job) -> float | None:
+        """Estimates the seconds until job finishes, or None until a job has completed."""
+        with self._condition:
+            if self._average_duration is None:
+                return None
+            if job.started_at is not None:
+                return max(self._average_duration - (time.monotonic() - job.started_at), 0.0)
+            try:
+                ahead = self._queue.index(job)
+            except ValueError:
+                return None
+            # Jobs ahead of this one finish in rounds of `workers`; this one runs in the round after them
+            return (ahead // max(self.workers, 1) + 1) * self._average_duration
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {**self.counters, "queued": len(self._queue), "running": len(self._running),
+                    "memory_in_use": self._memory_in_use}
+
+    def _start_workers(self) -> None:
+        # Callers hold self._condition
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"repo2llm-job-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def _admissible(self, job: Job) -> bool:
+        return not self._running or self._memory_in_use + job.memory_estimate <= self.memory_budget
+
+    def _worker(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue or not self._admissible(self._queue[0]):
+                    self._condition.wait()
+                job = self._queue.popleft()
+                job.state = "running"
+                job.started_at = time.monotonic()
+                self._running.append(job)
+                self._memory_in_use += job.memory_estimate
+
+            sampler = MemorySampler()
+            try:
+                result = job.work(job)
+            except Exception as e:
+                job.state = "failed"
+                job.push(f"❌ Error: {e}", LOG_WARNING)
+                job.future.set_exception(e)
+            else:
+                job.state = "done"
+                job.future.set_result(result)
+            usage = sampler.stop()
+            if usage is not None:
+                self.memory_model.observe(job.size, usage[1] * 1024 * 1024)
+
+            with self._condition:
+                duration = time.monotonic() - job.started_at
+                self._average_duration = duration if self._average_duration is None else \
+                    0.7 * self._average_duration + 0.3 * duration
+                self.counters["completed" if job.state == "done" else "failed"] += 1
+                self._running.remove(job)
+                self._memory_in_use -= job.memory_estimate
+                del self._inflight[job.key]
+                self._condition.notify_all()
+
+
+job_scheduler = JobScheduler()
+
+
+def submit_processing_job(repo_url: str, branch: str, max_tokens: int | None, priority: str,
+                          log: ProgressLog | None = None, include: Iterable[str] = (),
+                          exclude: Iterable[str] = (), languages: Iterable[str] = ("python",),
+                          mode: str = "full", dedupe: bool = False, order: str = "archive",
+                          size: int | None = None) -> Job:
+    """
+    Schedules download_and_process_repo, charging memory for a repository of size bytes (see repository_size)
+    against the scheduler's memory budget; identical requests in flight share one job.
+    """
+    include, exclude, languages = tuple(include), tuple(exclude), tuple(languages)
+    key = json.dumps([repo_url.rstrip("/"), branch, max_tokens, priority, include, exclude, languages, mode, dedupe,
+                      order])
+
+    def work(job_log: ProgressLog) -> tuple[OutputSink | None, str]:
+        with profile_job(get_repo_name_from_url(repo_url), job_log):
+            return download_and_process_repo(repo_url, branch, job_log, TempFileSink(), max_tokens, priority,
+                                             include=include, exclude=exclude, languages=languages,
+                                             mode=mode, dedupe=dedupe, order=order)
+
+    return job_scheduler.submit(key, work, log, size)
+
+
+# --- REST API ---
+# Headless access to the same pipeline, served by NiceGUI's FastAPI app next to the UI.
+
+def content_disposition(filename: str, disposition: str = "inline") -> str:
+    """
+    Builds a Content-Disposition header for a filename that may contain user input (e.g. a ref name):
+    a sanitized ASCII filename, plus the exact name percent-encoded as RFC 5987 filename*.
+    """
+    fallback = re.sub(r'[^\w.-]', "_", filename.encode("ascii", "replace").decode("ascii"))
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+
+
+async def _api_process(repo_url: str, branch: str, max_tokens: int | None, priority: str,
+                       log: ProgressLog, include: str = "", exclude: str = "", languages: str = "python",
+                       mode: str = "full", dedupe: bool = False, order: str = "archive") -> tuple[OutputSink, str]:
+    if priority not in BUDGET_PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {priority}")
+    if mode not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}")
+    if order not in OUTPUT_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown order: {order}")
+    language_names = parse_list(languages)
+    unknown = [name for name in language_names if name not in LANGUAGES]
+    if unknown or not language_names:
+        raise HTTPException(status_code=400, detail=f"Unknown languages: {', '.join(unknown) or languages!r}")
+    size = await run.io_bound(repository_size, repo_url)
+    try:
+        job = submit_processing_job(repo_url, branch, max_tokens, priority, log,
+                                    parse_list(include), parse_list(exclude), language_names, mode, dedupe, order,
+                                    size)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    try:
+        output, repo_name = await asyncio.wrap_future(job.future)
+    finally:
+        job.unsubscribe(log)
+    if output is None:
+        raise HTTPException(status_code=502, detail="Failed to process the repository.")
+    return output, repo_name
+
+
+@app.get('/api/process')
+async def api_process(repo_url: str, branch: str = "master", max_tokens: int | None = Query(None, gt=0),
+                      priority: str = "order", include: str = "", exclude: str = "",
+                      languages: str = "python", mode: str = "full", dedupe: bool = False,
+                      order: str = "archive") -> StreamingResponse:
+    """
+    Processes a repository and streams the concatenated output as chunked plain text.
+    include and exclude take comma-separated gitignore-style globs, languages comma-separated language names;
+    mode is one of OUTPUT_MODES, dedupe skips duplicate files and order is one of OUTPUT_ORDERS.
+    """
+    output, repo_name = await _api_process(repo_url, branch, max_tokens, priority, NullLog(), include, exclude,
+                                           languages, mode, dedupe, order)
+    headers = {
+        "Content-Disposition": content_disposition(f"{repo_name}_{branch}.txt"),
+        "X-File-Count": str(len(output.files)),
+        "X-Omitted-File-Count": str(len(output.omitted_files)),
+    }
+    # Left out when the token encoder was unavailable
+    if output.token_count is not None:
+        headers["X-Token-Count"] = str(output.token_count)
+    return StreamingResponse(output.iter_bytes(), media_type="text/plain; charset=utf-8", headers=headers)
+
+
+@app.get('/metrics')
+async def api_metrics() -> PlainTextResponse:
+    """Exports stage timings, file and token counters, and cache, scheduler and HTTP client stats for Prometheus."""
+    cache_stats, scheduler_stats = result_cache.stats(), job_scheduler.stats()
+    text = metrics.render(
+        counters={
+            "result_cache": {key: cache_stats[key] for key in result_cache.counters},
+            "job_scheduler": {key: scheduler_stats[key] for key in job_scheduler.counters},
+            "http_client": http_client.stats(),
+        },
+        gauges={
+            "result_cache": {key: cache_stats[key] for key in ("entries", "memory_bytes")},
+            "job_scheduler": {key: scheduler_stats[key] for key in ("queued", "running", "memory_in_use")},
+        })
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@app.get('/api/summary')
+async def api_summary(repo_url: str, branch: str = "master", max_tokens: int | None = Query(None, gt=0),
+                      priority: str = "order", include: str = "", exclude: str = "",
+                      languages: str = "python", mode: str = "full", dedupe: bool = False,
+                      order: str = "archive") -> JSONResponse:
+    """Processes a repository and returns its token counts, file index and processing log as JSON."""
+    log = CollectingLog()
+    output, repo_name = await _api_process(repo_url, branch, max_tokens, priority, log, include, exclude, languages,
+                                           mode, dedupe, order)
+    return JSONResponse({
+        "repo_name": repo_name,
+        "branch": branch,
+        "token_count": output.token_count,
+        "size_bytes": output.size_bytes,
+        "files": [{"path": f.path, "size_bytes": f.size_bytes, "token_count": f.token_count} for f in output.files],
+        "omitted_files": [{"path": f.path, "token_count": f.token_count} for f in output.omitted_files],
+        "log": log.messages,
+    })
+
+
+# --- Output Viewer ---
+# Browser sessions never receive the full output over the websocket: the preview fetches one page at a time,
+# and copy/download fetch the output from an HTTP endpoint that streams it straight from the sink.
+
+class OutputRegistry:
+    """Outputs shown in browser sessions, addressed by unguessable ids for the streaming endpoint."""
+
+    def __init__(self):
+        self._outputs: dict[str, tuple[OutputSink, str]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, output: OutputSink, filename: str) -> str:
+        output_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._outputs[output_id] = (output, filename)
+        return output_id
+
+    def get(self, output_id: str) -> tuple[OutputSink, str] | None:
+        with self._lock:
+            return self._outputs.get(output_id)
+
+    def remove(self, output_id: str | None) -> None:
+        with self._lock:
+            self._outputs.pop(output_id, None)
+
+
+output_registry = OutputRegistry()
+
+
+@app.get('/api/outputs/{output_id}')
+async def api_output(output_id: str, download: bool = False) -> StreamingResponse:
+    """Streams an output registered by a browser session, as an attachment when download is set."""
+    registered = output_registry.get(output_id)
+    if registered is None:
+        raise HTTPException(status_code=404, detail="Output not found. Process the repository again.")
+    output, filename = registered
+    headers = {
+        "Content-Disposition": content_disposition(filename, "attachment" if download else "inline"),
+        "Content-Length": str(output.size_bytes),
+        "Cache-Control": "no-store",
+    }
+    return StreamingResponse(output.iter_bytes(), media_type="text/plain; charset=utf-8", headers=headers)
+
+
+# --- Command Line Interface ---
+
+def parse_repo_spec(spec: str, default_branch: str) -> tuple[str, str]:
+    """Splits "URL#BRANCH" into (URL, BRANCH), falling back to default_branch."""
+    repo_url, _, branch = spec.partition("#")
+    return repo_url, branch or default_branch
+
+
+def cli_main(argv: list[str]) -> int:
+    """Processes one or more repositories concurrently without the web UI. Returns the exit code."""
+    parser = argparse.ArgumentParser(prog="python -m app process",
+                                     description="Concatenate repository sources into AI-ready text files.")
+    parser.add_argument("repos", nargs="*", metavar="URL[#BRANCH]",
+                        help="repositories to process: URLs, local git repositories or file:// URLs")
+    parser.add_argument("-f", "--from-file", help="file with one URL[#BRANCH] per line")
+    parser.add_argument("-b", "--branch", default="master", help="branch or tag when none is given (default: master)")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory for the output files (default: .)")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="repositories processed at once (default: 4)")
+    parser.add_argument("--max-tokens", type=int, help="token budget per repository")
+    parser.add_argument("--priority", choices=list(BUDGET_PRIORITIES), default="order",
+                        help="order in which files are packed into the token budget")
+    parser.add_argument("-l", "--languages", default="python",
+                        help=f"comma-separated languages to include (default: python; available: {', '.join(LANGUAGES)})")
+    parser.add_argument("--mode", choices=list(OUTPUT_MODES), default="full",
+                        help="full source, source without comments and blank lines, or signatures and docstrings only")
+    parser.add_argument("--dedupe", action="store_true", help="skip files identical to one already in the output")
+    parser.add_argument("--order", choices=list(OUTPUT_ORDERS), default="archive",
+                        help="order of the files in the output: as archived, dependencies first, or most central first")
+    parser.add_argument("--include", action="append", metavar="GLOB",
+                        help="only keep paths matching this gitignore-style glob (repeatable)")
+    parser.add_argument("--exclude", action="append", metavar="GLOB",
+                        help="drop paths matching this gitignore-style glob; !GLOB re-includes (repeatable)")
+    parser.add_argument("--incremental", metavar="DIR", default=MANIFEST_DIR or None,
+                        help="manifest directory; only files changed since the last run are processed")
+    parser.add_argument("--mirrors", metavar="DIR", default=MIRROR_DIR or None,
+                        help="fetch remote repositories into partial git mirrors under DIR instead of downloading archives")
+    parser.add_argument("--profile", metavar="DIR", default=PROFILE_DIR or None,
+                        help="profile each repository with cProfile/tracemalloc and write .prof files to DIR")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print the per-repository summary")
+    parser.add_argument("--verbosity", choices=list(LOG_VERBOSITY), default="verbose",
+                        help="progress messages to print: every file, ordinary progress, or warnings only")
+    args = parser.parse_args(argv)
+
+    specs = list(args.repos)
+    if args.from_file:
+        with open(args.from_file, encoding="utf-8") as spec_file:
+            specs.extend(line.strip() for line in spec_file if line.strip() and not line.startswith("#"))
+    if not specs:
+        parser.error("no repositories given")
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifests = ManifestStore(args.incremental) if args.incremental else None
+    mirrors = MirrorPool(args.mirrors) if args.mirrors else None
+    include, exclude = parse_list(args.include), parse_list(args.exclude)
+    languages = parse_list(args.languages)
+    unknown = [name for name in languages if name not in LANGUAGES]
+    if unknown or not languages:
+        parser.error(f"unknown languages: {', '.join(unknown) or args.languages!r}")
+    print_lock = threading.Lock()
+
+    def process(spec: str) -> bool:
+        repo_url, branch = parse_repo_spec(spec, args.branch)
+
+        def report(message: str) -> None:
+            if not args.quiet:
+                with print_lock:
+                    print(f"[{get_repo_name_from_url(repo_url)}@{branch}] {message}", file=sys.stderr)
+
+        log = CallbackLog(report, LOG_VERBOSITY[args.verbosity])
+        with profile_job(get_repo_name_from_url(repo_url), log, args.profile):
+            output, repo_name = download_and_process_repo(repo_url, branch, log, TempFileSink(),
+                                                          args.max_tokens, args.priority, manifests,
+                                                          include, exclude, languages, args.mode, args.dedupe,
+                                                          mirrors, allow_local=True, order=args.order)
+        summary = {"repo_url": repo_url, "branch": branch, "ok": output is not None}
+        if output is not None:
+            path = os.path.join(args.output_dir, f"{repo_name}_{branch.replace('/', '_')}.txt")
+            with open(path, "wb") as target:
+                for block in output.iter_bytes():
+                    target.write(block)
+            summary.update(path=path, token_count=output.token_count, files=len(output.files),
+                           omitted_files=len(output.omitted_files))
+        with print_lock:
+            print(json.dumps(summary), flush=True)
+        return output is not None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+            results = list(executor.map(process, specs))
+    finally:
+        # Stop the file processing workers before the interpreter starts tearing down
+        shutdown_process_pool()
+    return 0 if all(results) else 1
 
 
 # --- NiceGUI User Interface Definition ---
@@ -326,22 +2906,65 @@ def download_and_process_repo(repo_url: str, branch_or_tag: str, log: ui.log) ->
 def main_page():
     """Defines the layout and functionality of the web interface."""
     
-    # Store processed content and filename globally for download
-    processed_data = {'content': '', 'filename': ''}
+    # Store processed output and filename globally for download
+    processed_data = {'output': None, 'filename': '', 'shard_dir': None, 'output_id': None,
+                      'offset': 0, 'page_end': 0, 'history': [], 'job_log': None}
+    ui.context.client.on_disconnect(lambda: output_registry.remove(processed_data['output_id']))
+
+    def show_page(offset: int) -> None:
+        """Shows the page of output starting at offset in the preview."""
+        output = processed_data['output']
+        with metrics.time("repo2llm_ui_update_seconds_total", kind="preview"):
+            text, end = output.read_text(offset, PREVIEW_PAGE_BYTES)
+            processed_data['offset'], processed_data['page_end'] = offset, end
+            preview.set_text(text)
+        metrics.inc("repo2llm_ui_updates_total", kind="preview")
+        entry = output.file_at(offset)
+        page_label.set_text(f'{offset / 1024:,.1f}–{end / 1024:,.1f} KB of {output.size_bytes / 1024:,.1f} KB'
+                            f' · {entry.path if entry else "header"}')
+        previous_button.set_enabled(bool(processed_data['history']))
+        next_button.set_enabled(end < output.size_bytes)
+
+    def next_page():
+        processed_data['history'].append(processed_data['offset'])
+        show_page(processed_data['page_end'])
+
+    def previous_page():
+        if processed_data['history']:
+            show_page(processed_data['history'].pop())
+
+    def jump_to_file(e):
+        if e.value is None or processed_data['output'] is None:
+            return
+        processed_data['history'].append(processed_data['offset'])
+        show_page(processed_data['output'].files[e.value].offset)
+
+    def reset_viewer():
+        preview.set_text('Processed repository content will appear here...')
+        page_label.set_text('')
+        file_select.set_options({})
+        previous_button.set_enabled(False)
+        next_button.set_enabled(False)
 
     async def process_repository():
         """Handles the button click event to start processing the repository."""
         log.clear()
-        output_area.set_value('')
+        reset_viewer()
+        progress_bar.set_value(0)
+        progress_label.set_text('')
+        log_download_button.set_enabled(False)
         token_count_label.set_text('Calculating...')
         file_size_label.set_text('Calculating...')
         process_button.set_visibility(False)
         spinner.set_visibility(True)
         download_button.set_enabled(False)
         copy_button.set_enabled(False)
+        shard_button.set_enabled(False)
+        shard_links.clear()
 
         repo_url = repo_input.value
         branch = branch_input.value
+        max_tokens = int(budget_input.value or 0) or None
 
         if not repo_url:
             ui.notify('Repository URL cannot be empty.', type='negative')
@@ -349,64 +2972,178 @@ def main_page():
             spinner.set_visibility(False)
             return
 
-        content, repo_name = await run.io_bound(download_and_process_repo, repo_url, branch, log)
+        # Progress is buffered off the event loop and shown in batches by flush_log
+        job_log = BatchedLog(LOG_VERBOSITY[verbosity_select.value])
+        processed_data['job_log'] = job_log
+        size = await run.io_bound(repository_size, repo_url)
+        try:
+            job = submit_processing_job(repo_url, branch, max_tokens, priority_select.value, job_log,
+                                        parse_list(include_input.value), parse_list(exclude_input.value),
+                                        languages_select.value or ["python"], mode_select.value,
+                                        dedupe_checkbox.value, order_select.value, size)
+        except QueueFullError as e:
+            ui.notify(str(e), type='warning', position='top')
+            process_button.set_visibility(True)
+            spinner.set_visibility(False)
+            return
+
+        def update_job_status():
+            position = job_scheduler.position(job)
+            eta = job_scheduler.eta(job)
+            eta_text = f'ETA ~{eta:.0f} s' if eta is not None else 'ETA estimating...'
+            if position is not None:
+                job_status_label.set_text(f'⏳ Queued: position {position}, {eta_text}')
+            else:
+                job_status_label.set_text(f'⚙️ Processing, {eta_text}')
+
+        def flush_log():
+            messages, progress = job_log.drain()
+            if not messages and progress is None:
+                return
+            with metrics.time("repo2llm_ui_update_seconds_total", kind="log"):
+                # One push per message, so max_lines counts lines rather than batches; older ones would be trimmed
+                for message in messages[-LOG_MAX_LINES:]:
+                    log.push(message)
+                if progress is not None:
+                    done, total = progress
+                    progress_bar.set_value(done / total if total else 1)
+                    progress_label.set_text(f'{done:,} / {total:,} files')
+            metrics.inc("repo2llm_ui_updates_total", kind="log")
+
+        update_job_status()
+        job_status_label.set_visibility(True)
+        status_timer = ui.timer(1.0, update_job_status)
+        log_timer = ui.timer(LOG_FLUSH_INTERVAL, flush_log)
+        try:
+            output, repo_name = await asyncio.wrap_future(job.future)
+        except Exception:
+            output, repo_name = None, get_repo_name_from_url(repo_url)
+        finally:
+            status_timer.cancel()
+            log_timer.cancel()
+            job.unsubscribe(job_log)
+            flush_log()
+            job_status_label.set_visibility(False)
+            log_download_button.set_enabled(True)
 
         process_button.set_visibility(True)
         spinner.set_visibility(False)
 
-        if content is not None:
-            output_area.set_value(content)
-            
+        if output is not None:
             # Calculate metrics
-            num_tokens = get_token_count(content)
-            file_size_kb = len(content.encode('utf-8')) / 1024
+            num_tokens = output.token_count
+            file_size_kb = output.size_bytes / 1024
             
-            token_count_label.set_text(f'{num_tokens:,}')
+            token_count_label.set_text(f'{num_tokens:,}' if num_tokens is not None else 'n/a')
             file_size_label.set_text(f'{file_size_kb:.2f} KB')
+            if output.omitted_files:
+                ui.notify(f'✂️ {len(output.omitted_files)} files left out to fit the token budget. See log for details.',
+                          type='warning', position='top')
             
             # Store processed data for download
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            processed_data['content'] = content
+            processed_data['output'] = output
             processed_data['filename'] = f"{repo_name}_{branch}_{timestamp}.txt"
+            output_registry.remove(processed_data['output_id'])
+            processed_data['output_id'] = output_registry.add(output, processed_data['filename'])
+
+            # Preview the first page; other pages are read on demand
+            processed_data['history'] = []
+            file_select.set_options({index: entry.path for index, entry in enumerate(output.files)})
+            show_page(0)
             
             # Enable action buttons
             download_button.set_enabled(True)
             copy_button.set_enabled(True)
+            shard_button.set_enabled(True)
             
             ui.notify(f'✨ Repository processed successfully! Ready to download as: {processed_data["filename"]}', 
                      type='positive', position='top', timeout=5000)
         else:
             ui.notify('Failed to process repository. Check log for details.', type='negative', position='top')
 
-    async def copy_to_clipboard():
-        """Copies the output text to the user's clipboard."""
-        text = output_area.value
-        if not text:
+    def copy_to_clipboard():
+        """Copies the output text to the user's clipboard, fetched by the browser from the output endpoint."""
+        if processed_data['output_id'] is None:
             ui.notify('There is no content to copy.', type='warning', position='top')
             return
-        # Use ui.run_javascript properly for clipboard access
+        url = json.dumps(f"/api/outputs/{processed_data['output_id']}")
+        # ClipboardItem accepts a pending fetch, which keeps the click's user activation in Safari
         js_code = f'''
-            navigator.clipboard.writeText({json.dumps(text)}).then(
-                () => console.log("Copied to clipboard"),
-                (err) => console.error("Failed to copy:", err)
-            );
+            navigator.clipboard.write([new ClipboardItem({{"text/plain": fetch({url}).then(r => r.blob())}})])
+                .catch(() => fetch({url}).then(r => r.text()).then(text => navigator.clipboard.writeText(text)))
+                .then(
+                    () => console.log("Copied to clipboard"),
+                    (err) => console.error("Failed to copy:", err)
+                );
         '''
-        await ui.run_javascript(js_code)
+        ui.run_javascript(js_code)
         ui.notify('✅ Output copied to clipboard!', type='positive', position='top')
 
+    def download_log():
+        """Downloads the full processing log, including messages hidden by the verbosity setting."""
+        job_log = processed_data['job_log']
+        if job_log is None:
+            ui.notify('There is no log to download yet.', type='warning', position='top')
+            return
+        name = processed_data['filename'].rsplit('.', 1)[0] or 'repo2llm'
+        ui.download(job_log.getvalue().encode('utf-8'), f'{name}.log')
+
+    def set_verbosity(e):
+        if processed_data['job_log'] is not None:
+            processed_data['job_log'].min_level = LOG_VERBOSITY[e.value]
+
     def download_file():
-        """Triggers download of the processed content as a text file."""
-        if not processed_data['content']:
+        """Triggers download of the processed content as a text file, streamed from the output endpoint."""
+        if processed_data['output_id'] is None:
             ui.notify('No content to download. Please process a repository first.', type='warning', position='top')
             return
         
-        # Create download using NiceGUI's download mechanism
-        ui.download(
-            processed_data['content'].encode('utf-8'), 
-            processed_data['filename']
-        )
+        ui.download(f"/api/outputs/{processed_data['output_id']}?download=true", processed_data['filename'])
         ui.notify(f'📥 Downloading: {processed_data["filename"]}', type='positive', position='top')
 
+    async def download_shards():
+        """Splits the processed content into parts under the chosen limit and downloads them."""
+        output = processed_data['output']
+        if output is None:
+            ui.notify('No content to download. Please process a repository first.', type='warning', position='top')
+            return
+        limit = int(shard_limit_input.value or 0)
+        if limit <= 0:
+            ui.notify('Part size limit must be greater than zero.', type='warning', position='top')
+            return
+
+        if shard_unit_select.value == 'tokens':
+            if output.token_count is None:
+                ui.notify('Token counts are unavailable for this output; split it by KB instead.',
+                          type='warning', position='top')
+                return
+            shards = plan_shards(output, max_tokens=limit)
+        else:
+            shards = plan_shards(output, max_bytes=limit * 1024)
+
+        # Parts are written to a per-client directory that is removed when the client disconnects
+        if processed_data['shard_dir'] is None:
+            processed_data['shard_dir'] = tempfile.mkdtemp(prefix='repo2llm-parts-')
+            ui.context.client.on_disconnect(lambda: shutil.rmtree(processed_data['shard_dir'], ignore_errors=True))
+        directory = tempfile.mkdtemp(dir=processed_data['shard_dir'])
+        as_zip = shard_delivery_select.value == 'zip'
+        paths = await run.io_bound(write_shards, output, shards, processed_data['filename'], directory, as_zip)
+
+        shard_links.clear()
+        if as_zip:
+            ui.download(paths[0], os.path.basename(paths[0]))
+            ui.notify(f'📥 Downloading {len(shards)} parts', type='positive', position='top')
+            return
+        # Browsers block every download but the first when several start at once, so each part gets a link
+        with shard_links:
+            for path in paths:
+                name = os.path.basename(path)
+                ui.button(name, icon='download', on_click=lambda path=path, name=name: ui.download(path, name)) \
+                    .props('flat dense no-caps')
+        ui.notify(f'📄 {len(shards)} parts ready: download them from the links below',
+                  type='positive', position='top')
+
     # --- UI Layout ---
     
     # Add custom CSS
@@ -469,18 +3206,67 @@ def main_page():
                     value="master"
                 ).props('outlined dense').style('width: 150px')
 
+            with ui.row().classes('w-full items-end gap-4 mt-2'):
+                budget_input = ui.number(
+                    label="Token Budget (0 = unlimited)",
+                    value=0, min=0, step=1000, format='%d'
+                ).props('outlined dense').style('width: 220px')
+
+                priority_select = ui.select(
+                    BUDGET_PRIORITIES, label="Budget Priority", value="order"
+                ).props('outlined dense').style('width: 220px')
+
+                languages_select = ui.select(
+                    list(LANGUAGES), label="Languages", value=["python"], multiple=True
+                ).props('outlined dense use-chips').classes('flex-grow')
+
+            with ui.row().classes('w-full items-end gap-4 mt-2'):
+                mode_select = ui.select(
+                    OUTPUT_MODES, label="Output Mode", value="full"
+                ).props('outlined dense').style('width: 300px')
+
+                order_select = ui.select(
+                    OUTPUT_ORDERS, label="Output Order", value="archive"
+                ).props('outlined dense').style('width: 220px')
+
+                dedupe_checkbox = ui.checkbox('Skip duplicate files', value=False)
+
+            with ui.row().classes('w-full items-end gap-4 mt-2'):
+                include_input = ui.input(
+                    label="Include globs (optional)",
+                    placeholder="src/**, *.py"
+                ).props('outlined dense').classes('flex-grow')
+
+                exclude_input = ui.input(
+                    label="Exclude globs (optional)",
+                    placeholder="migrations/, !migrations/keep.py"
+                ).props('outlined dense').classes('flex-grow')
+
             with ui.row().classes('gap-3 mt-4'):
                 process_button = ui.button('Process Repository', on_click=process_repository).classes('magic-btn').props('rounded size=lg icon=hub')
                 spinner = ui.spinner(size='lg', color=BRAND_COLORS['primary'])
                 spinner.set_visibility(False)
+                job_status_label = ui.label('').classes('self-center text-gray-600')
+                job_status_label.set_visibility(False)
 
         # Processing log card
         with ui.card().classes('w-full max-w-4xl magic-card p-6'):
             with ui.row().classes('w-full justify-between items-center mb-3'):
                 ui.label('Processing Log').classes('text-xl font-semibold').style(f'color: {BRAND_COLORS["primary"]}')
-                ui.html(f'<span class="magic-badge">Live Updates</span>')
-            
-            log = ui.log().classes('w-full h-48 magic-log p-3')
+                with ui.row().classes('items-center gap-2'):
+                    verbosity_select = ui.select(
+                        {'verbose': 'Every file', 'normal': 'Progress', 'warnings': 'Warnings only'},
+                        label='Verbosity', value='normal', on_change=set_verbosity
+                    ).props('outlined dense').style('width: 160px')
+                    log_download_button = ui.button(icon='description', on_click=download_log).props(
+                        'flat round').tooltip('Download full log')
+                    log_download_button.set_enabled(False)
+                    ui.html(f'<span class="magic-badge">Live Updates</span>')
+
+            with ui.row().classes('w-full items-center gap-3 mb-2'):
+                progress_bar = ui.linear_progress(value=0, show_value=False).classes('flex-grow')
+                progress_label = ui.label('').classes('text-sm text-gray-600')
+            log = ui.log(max_lines=LOG_MAX_LINES).classes('w-full h-48 magic-log p-3')
 
         # Output information card
         with ui.card().classes('w-full max-w-4xl magic-card p-6'):
@@ -514,8 +3300,32 @@ def main_page():
                                           on_click=copy_to_clipboard).classes('magic-btn-secondary').props('rounded')
                     copy_button.set_enabled(False)
 
-            output_area = ui.textarea().classes('w-full h-96 font-mono magic-output p-3').props(
-                'outlined readonly placeholder="Processed repository content will appear here..."')
+            # Paged preview: only the visible page is sent to the browser
+            with ui.row().classes('w-full items-center gap-2 mb-2'):
+                file_select = ui.select({}, label='Jump to file', with_input=True,
+                                        on_change=jump_to_file).props('outlined dense').classes('flex-grow')
+                previous_button = ui.button(icon='chevron_left', on_click=previous_page).props('flat round')
+                next_button = ui.button(icon='chevron_right', on_click=next_page).props('flat round')
+            page_label = ui.label('').classes('text-sm text-gray-600')
+            preview = ui.label('').classes('w-full h-96 overflow-auto whitespace-pre font-mono text-sm magic-output p-3')
+            reset_viewer()
+
+            # Split download for repositories that exceed one context window
+            with ui.row().classes('w-full items-end gap-4 mt-3'):
+                shard_limit_input = ui.number(
+                    label="Part Size Limit", value=100000, min=1, step=1000, format='%d'
+                ).props('outlined dense').style('width: 180px')
+                shard_unit_select = ui.select(
+                    {'tokens': 'Tokens', 'kb': 'KB'}, label="Limit Unit", value='tokens'
+                ).props('outlined dense').style('width: 120px')
+                shard_delivery_select = ui.select(
+                    {'zip': 'Zip archive', 'files': 'Separate files'}, label="Delivery", value='zip'
+                ).props('outlined dense').style('width: 160px')
+                shard_button = ui.button('Download Parts', icon='call_split',
+                                         on_click=download_shards).classes('magic-btn-secondary').props('rounded')
+                shard_button.set_enabled(False)
+            # One link per part for the "Separate files" delivery
+            shard_links = ui.row().classes('w-full flex-wrap gap-2')
 
         # Footer
         with ui.row().classes('mt-12 items-center gap-4 text-gray-500'):
@@ -526,5 +3336,11 @@ def main_page():
             ui.label('© 2025 MAGIC Research. All rights reserved.')
 
 
-# Run the NiceGUI application with star favicon
-ui.run(title='MAGIC-Repo2LLM - GitHub to LLM Converter', favicon='✨', dark=False, port=8080, host='0.0.0.0')
+# Load the token encoder in the background so the first job does not pay for it
+app.on_startup(lambda: threading.Thread(target=token_counter.preload, daemon=True).start())
+
+# Run the command line interface ("python -m app process ..."), or else the NiceGUI application with star favicon
+if __name__ == "__main__" and sys.argv[1:2] == ["process"]:
+    sys.exit(cli_main(sys.argv[2:]))
+if __name__ in {"__main__", "__mp_main__"}:
+    ui.run(title='MAGIC-Repo2LLM - GitHub to LLM Converter', favicon='✨', dark=False, port=8080, host='0.0.0.0')
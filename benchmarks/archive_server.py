@@ -0,0 +1,43 @@
+"""A local HTTP server that serves synthetic archives the way GitHub serves branch archives."""
+import re
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ARCHIVE_PATH = re.compile(r"^/([^/]+)/archive/refs/heads/([^/]+)\.zip$")
+CHUNK_SIZE = 256 * 1024
+
+
+@contextmanager
+def serve_archives(archives: dict[str, bytes]) -> Iterator[str]:
+    """
+    Serves each archive at /<name>/archive/refs/heads/<any branch>.zip on a free local port.
+    Yields the base URL; the repository URL of an archive is f"{base_url}/{name}".
+    """
+
+    class ArchiveHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = ARCHIVE_PATH.match(self.path)
+            archive = archives.get(match.group(1)) if match else None
+            if archive is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/zip")
+            self.send_header("Content-Length", str(len(archive)))
+            self.end_headers()
+            for start in range(0, len(archive), CHUNK_SIZE):
+                self.wfile.write(archive[start:start + CHUNK_SIZE])
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark: serves synthetic archives from a local HTTP server, times download_and_process_repo on
+each scenario and get_token_count on its output, and writes the results as JSON so runs can be compared
+across versions. Run it with the result, archive and manifest caches disabled (the default settings).
+
+Usage: python benchmarks/bench_end_to_end.py [--files N] [--repeat N] [--scenario NAME ...] [--output PATH]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app  # noqa: E402
+from archive_server import serve_archives  # noqa: E402
+from synthetic import build_archive  # noqa: E402
+
+# Scenario name -> build_archive knobs
+SCENARIOS = {
+    "uniform": {"size_distribution": "fixed"},
+    "skewed": {"size_distribution": "lognormal"},
+    "mixed": {"size_distribution": "pareto", "test_share": 0.1, "non_utf8_share": 0.01, "deep_path_share": 0.2},
+}
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parents[1],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stage_seconds(before: dict[str, float], after: dict[str, float]) -> dict[str, float]:
+    """Returns the per-stage seconds added to the metrics registry between two snapshots."""
+    prefix = 'repo2llm_stage_seconds_total{stage="'
+    return {key[len(prefix):-2]: round(value - before.get(key, 0.0), 4)
+            for key, value in after.items() if key.startswith(prefix)}
+
+
+def run_scenario(repo_url: str, file_count: int, archive_bytes: int, repeat: int) -> dict:
+    """Processes repo_url `repeat` times and reports the fastest run, and the memory used by all runs."""
+    memory = app.MemorySampler()
+    best = None
+    for _ in range(repeat):
+        before = app.metrics.snapshot()
+        start = time.perf_counter()
+        output, _ = app.download_and_process_repo(repo_url, "main", app.NullLog(), app.TempFileSink())
+        elapsed = time.perf_counter() - start
+        if output is None:
+            raise RuntimeError(f"Processing {repo_url} failed")
+        if best is None or elapsed < best[0]:
+            best = (elapsed, output, stage_seconds(before, app.metrics.snapshot()))
+    elapsed, output, stages = best
+
+    text = output.getvalue()
+    start = time.perf_counter()
+    tokens = app.get_token_count(text)
+    token_seconds = time.perf_counter() - start
+    usage = memory.stop()
+
+    return {
+        "files": file_count,
+        "files_processed": len(output.files),
+        "archive_mb": round(archive_bytes / 1024 / 1024, 3),
+        "output_mb": round(output.size_bytes / 1024 / 1024, 3),
+        "tokens": output.token_count,
+        "seconds": round(elapsed, 4),
+        "files_per_s": round(file_count / elapsed, 1),
+        "archive_mb_per_s": round(archive_bytes / 1024 / 1024 / elapsed, 2),
+        "tokens_per_s": round(output.token_count / elapsed),
+        "stage_seconds": stages,
+        "get_token_count": {
+            "seconds": round(token_seconds, 4),
+            "tokens_per_s": round(tokens / token_seconds),
+            "mb_per_s": round(len(text.encode("utf-8")) / 1024 / 1024 / token_seconds, 2),
+            "matches_pipeline": tokens == output.token_count,
+        },
+        # Sampled while this scenario ran; the growth excludes memory still held from earlier scenarios
+        "peak_rss_mb": round(usage[0], 1) if usage else None,
+        "peak_rss_growth_mb": round(usage[1], 1) if usage else None,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=10_000, help="files per synthetic archive (default: 10000)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario; the fastest is kept (default: 3)")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="scenarios to run (default: all)")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/e2e_<timestamp>.json)")
+    args = parser.parse_args()
+
+    try:
+        app.token_counter.get_encoding()
+    except Exception as e:
+        print(f"The token encoder could not be loaded: {e}", file=sys.stderr)
+        return 1
+
+    names = args.scenario or list(SCENARIOS)
+    archives = {name: build_archive(args.files, **SCENARIOS[name]) for name in names}
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"parallel_workers": app.PARALLEL_WORKERS, "token_threads": app.TOKEN_THREADS,
+                     "token_batch_size": app.TOKEN_BATCH_SIZE, "spool_threshold": app.ARCHIVE_SPOOL_THRESHOLD},
+        "scenarios": {},
+    }
+    with serve_archives(archives) as base_url:
+        for name in names:
+            result = run_scenario(f"{base_url}/{name}", args.files, len(archives[name]), args.repeat)
+            results["scenarios"][name] = {"knobs": SCENARIOS[name], **result}
+            print(f"{name:<10} {result['seconds'] * 1000:9.1f} ms  {result['files_per_s']:9,.0f} files/s  "
+                  f"{result['archive_mb_per_s']:6.2f} MB/s  {result['tokens_per_s']:11,} tokens/s  "
+                  f"get_token_count {result['get_token_count']['tokens_per_s']:11,} tokens/s")
+
+    output_path = Path(args.output) if args.output else \
+        Path(__file__).resolve().parent / "results" / f"e2e_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    print(f"Results written to {output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Compares the legacy string concatenation with the output sinks on a synthetic 10k-file archive.
+
+Usage: python benchmarks/bench_output_sink.py [file_count]
+"""
+import io
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app  # noqa: E402
+from synthetic import build_archive  # noqa: E402
+
+
+def legacy_concatenation(chunks: list[tuple[str | None, str]]) -> None:
+    """The pre-sink output path: grow one string with +=, then encode it for the size metric and the download."""
+    file_contents = ""
+    for _, chunk in chunks:
+        file_contents += chunk
+    len(file_contents.encode("utf-8"))
+    file_contents.encode("utf-8")
+
+
+def sink_output(chunks: list[tuple[str | None, str]], sink: app.OutputSink) -> None:
+    """The sink output path: write chunks once, read the size counter and stream the download bytes."""
+    for file_path, chunk in chunks:
+        sink.write(chunk, file_path)
+    _ = sink.size_bytes
+    for _ in sink.iter_bytes():
+        pass
+    sink.close()
+
+
+def timed(label: str, func, *args) -> None:
+    start = time.perf_counter()
+    func(*args)
+    print(f"{label:<28} {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+
+def main() -> None:
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    archive = build_archive(file_count)
+    print(f"Synthetic archive: {file_count} files, {len(archive) / 1024 / 1024:.1f} MB compressed")
+
+    zip_file = zipfile.ZipFile(io.BytesIO(archive))
+    start = time.perf_counter()
+    chunks = list(app.iter_output_chunks(zip_file, "https://github.com/example/repo", "main", app.NullLog()))
+    print(f"{'filtering + decoding':<28} {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+    timed("legacy += concatenation", legacy_concatenation, chunks)
+    timed("StringSink", sink_output, chunks, app.StringSink())
+    timed("TempFileSink (1 MB spool)", sink_output, chunks, app.TempFileSink(max_size=1024 * 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compares the legacy per-call path checks with the compiled PathFilter on a synthetic 100k-path namelist,
+and checks that both keep exactly the same paths.
+
+Usage: python benchmarks/bench_path_filter.py [path_count]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app  # noqa: E402
+
+
+def legacy_is_likely_useful_file(file_path: str, lang: str = "python") -> bool:
+    """The pre-compilation implementation: rebuilds the exclusion lists and scans them on every call."""
+    excluded_dirs = ["docs", "examples", "tests", "test", "scripts", "utils", "benchmarks"]
+    utility_or_config_files = []
+    github_workflow_or_docs = [".github", ".gitignore", "LICENSE"]
+
+    if lang == "python":
+        excluded_dirs.append("__pycache__")
+        utility_or_config_files.extend(["hubconf.py", "setup.py"])
+        github_workflow_or_docs.extend(["stale.py", "gen-card-", "write_model_card"])
+    elif lang == "go":
+        excluded_dirs.append("vendor")
+        utility_or_config_files.extend(["go.mod", "go.sum", "Makefile"])
+
+    if any(part.startswith(".") for part in file_path.split("/")):
+        return False
+    if "test" in file_path.lower():
+        return False
+    for excluded_dir in excluded_dirs:
+        if f"/{excluded_dir}/" in file_path or file_path.startswith(excluded_dir + "/"):
+            return False
+    for file_name in utility_or_config_files:
+        if file_name in file_path:
+            return False
+    for doc_file in github_workflow_or_docs:
+        if doc_file in file_path:
+            return False
+    return True
+
+
+SEGMENTS = ["src", "lib", "pkg", "core", "models", "docs", "examples", "tests", "Testing", "scripts", "utils",
+            "vendor", "__pycache__", ".github", "internal", "api", "benchmarks", "contrib", "nn", "io"]
+FILE_NAMES = ["module.py", "setup.py", "hubconf.py", "stale.py", "gen-card-x.py", "write_model_card.py",
+              "LICENSE", ".gitignore", "go.mod", "go.sum", "Makefile", "main.go", "test_io.py", "conftest.py",
+              "README.md", "layers.py", "_private.py", ".hidden.py"]
+
+
+def build_namelist(path_count: int = 100_000, seed: int = 0) -> list[str]:
+    """Builds a deterministic namelist mixing ordinary sources with every kind of built-in exclusion."""
+    rng = random.Random(seed)
+    paths = []
+    for index in range(path_count):
+        depth = rng.randint(0, 6)
+        segments = [rng.choice(SEGMENTS) if rng.random() < 0.3 else f"d{rng.randint(0, 99)}" for _ in range(depth)]
+        name = rng.choice(FILE_NAMES) if rng.random() < 0.3 else f"file_{index}.py"
+        paths.append("/".join(segments + [name]))
+    return paths
+
+
+def timed(label: str, func, paths: list[str]) -> list[bool]:
+    start = time.perf_counter()
+    results = [func(path) for path in paths]
+    print(f"{label:<30} {(time.perf_counter() - start) * 1000:9.1f} ms  ({sum(results)} kept)")
+    return results
+
+
+def main() -> None:
+    path_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    paths = build_namelist(path_count)
+    print(f"Synthetic namelist: {len(paths)} paths")
+
+    for lang in ("python", "go"):
+        print(f"[{lang}]")
+        legacy = timed("legacy per-call checks", lambda path: legacy_is_likely_useful_file(path, lang), paths)
+        compiled = timed("compiled PathFilter", app.get_path_filter(lang), paths)
+        assert legacy == compiled, "compiled filter disagrees with the legacy checks"
+
+    with_globs = app.get_path_filter("python", include=["src/**", "*.py"], exclude=["nn/", "!nn/keep.py", "io"])
+    timed("PathFilter + user globs", with_globs, paths)
+
+
+if __name__ == "__main__":
+    main()
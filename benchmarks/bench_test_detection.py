@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Checks that the fast test-file detector agrees with the full AST walk and compares their CPU time.
+The corpus is every Python file of the running interpreter's standard library (including its test suite),
+or the directory given on the command line.
+
+Usage: python benchmarks/bench_test_detection.py [corpus_dir]
+"""
+import sys
+import sysconfig
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app  # noqa: E402
+
+
+def load_corpus(root: Path) -> list[str]:
+    corpus = []
+    for path in sorted(root.rglob("*.py")):
+        try:
+            source = path.read_bytes().decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            continue
+        if "\0" not in source:
+            corpus.append(source)
+    return corpus
+
+
+def detect_all(corpus: list[str], fast: bool) -> tuple[float, list[bool]]:
+    start = time.process_time()
+    verdicts = [app.is_test_file(source, "python", fast=fast) for source in corpus]
+    return time.process_time() - start, verdicts
+
+
+def main() -> None:
+    root = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(sysconfig.get_paths()["stdlib"])
+    corpus = load_corpus(root)
+    print(f"Corpus: {len(corpus)} files from {root}")
+
+    ast_time, ast_verdicts = detect_all(corpus, fast=False)
+    fast_time, fast_verdicts = detect_all(corpus, fast=True)
+
+    mismatches = sum(a != b for a, b in zip(ast_verdicts, fast_verdicts))
+    print(f"{'full AST walk':<16} {ast_time * 1000:9.1f} ms CPU")
+    print(f"{'fast detector':<16} {fast_time * 1000:9.1f} ms CPU")
+    print(f"test files: {sum(ast_verdicts)}, mismatches: {mismatches}, speed-up: {ast_time / fast_time:.2f}x")
+    assert mismatches == 0, "fast detector disagrees with the full AST walk"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Deterministic synthetic GitHub-style repository archives for benchmarks."""
+import io
+import math
+import random
+import zipfile
+
+SIZE_DISTRIBUTIONS = ("fixed", "lognormal", "pareto")
+
+
+def file_line_count(rng: random.Random, lines_per_file: int, size_distribution: str) -> int:
+    """Draws the number of functions in one file: always lines_per_file, or a skewed spread around it."""
+    if size_distribution == "fixed":
+        return lines_per_file
+    if size_distribution == "lognormal":
+        return max(1, int(rng.lognormvariate(math.log(lines_per_file), 1.0)))
+    if size_distribution == "pareto":
+        # A few very large files, capped so one file cannot dominate the archive
+        return max(1, min(int(lines_per_file * rng.paretovariate(1.5) / 3), lines_per_file * 200))
+    raise ValueError(f"Unknown size distribution: {size_distribution}")
+
+
+def build_archive(file_count: int = 10_000, lines_per_file: int = 40, seed: int = 0,
+                  root: str = "synthetic-repo-main", size_distribution: str = "fixed", test_share: float = 0.0,
+                  non_utf8_share: float = 0.0, deep_path_share: float = 0.0, max_depth: int = 12) -> bytes:
+    """
+    Builds an in-memory zip laid out like a GitHub branch archive (every entry under a single root directory).
+    The same arguments always produce the same archive.
+
+    size_distribution spreads the file sizes around lines_per_file (see SIZE_DISTRIBUTIONS). test_share of the
+    files import pytest, non_utf8_share are Latin-1 encoded so they fail to decode, and deep_path_share sit
+    up to max_depth directories below src/. None of these change the paths, so only content-based checks
+    (test detection, decoding) skip the test and non-UTF-8 files.
+    """
+    rng = random.Random(seed)
+    # Layout decisions use their own generator so the default archive does not depend on the knobs
+    layout_rng = random.Random(seed + 1)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(f"{root}/", "")
+        for index in range(file_count):
+            package = f"pkg{index % 50}"
+            line_count = file_line_count(layout_rng, lines_per_file, size_distribution)
+            body = "\n".join(
+                f"def func_{index}_{line}(value):\n    return value * {rng.randint(1, 1000)}\n"
+                for line in range(line_count)
+            )
+            source = f'"""Module {index}."""\n{body}\n'
+            if test_share and layout_rng.random() < test_share:
+                source = f"import pytest\n{source}"
+
+            directory = f"src/{package}"
+            if deep_path_share and layout_rng.random() < deep_path_share:
+                depth = layout_rng.randint(2, max_depth)
+                directory = "src/" + "/".join(f"level{level}" for level in range(depth)) + f"/{package}"
+
+            path = f"{root}/{directory}/module_{index}.py"
+            if non_utf8_share and layout_rng.random() < non_utf8_share:
+                zip_file.writestr(path, f"# Café {index}\n{source}".encode("latin-1"))
+            else:
+                zip_file.writestr(path, source)
+    return buffer.getvalue()
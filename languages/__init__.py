@@ -0,0 +1,113 @@
+"""
+Language handlers: which files of a repository belong to a language, which paths to skip and how to
+recognise test files, plus how to compress a file for the reduced output modes and which modules it imports.
+
+The registry only records each language's handler module and file extensions, so routing a path to its
+language imports nothing; a handler module is imported the first time its language is actually used.
+Third-party handlers can be added with register_language.
+"""
+import importlib
+import os
+import threading
+from collections.abc import Iterable
+
+# Directories and path markers skipped for every language
+COMMON_EXCLUDED_DIRS = ["docs", "examples", "tests", "test", "scripts", "utils", "benchmarks"]
+COMMON_EXCLUDED_NAMES = [".github", ".gitignore", "LICENSE"]
+
+# Output modes: verbatim source, source without comments and blank lines, or only the API surface
+# (signatures and docstrings). Handlers without structural support treat "signatures" like "strip".
+OUTPUT_MODES = {
+    "full": "Full source",
+    "strip": "Without comments and blank lines",
+    "signatures": "Signatures and docstrings",
+}
+
+
+class LanguageHandler:
+    """
+    Base class of language handlers. Subclasses set the class attributes and override is_test_file,
+    and may override compress or process; a handler module exposes its instance as `handler`.
+    """
+    name: str = ""
+    extensions: tuple[str, ...] = ()
+    excluded_dirs: tuple[str, ...] = ()   # directory names skipped in addition to COMMON_EXCLUDED_DIRS
+    excluded_names: tuple[str, ...] = ()  # substrings of config/tooling paths skipped anywhere in a path
+    comment_prefix: str | None = None     # line comment marker used by the line-based "strip" mode
+
+    def is_test_file(self, file_content: str, fast: bool = True) -> bool:
+        """Returns True if the file content looks like a test file. The base handler never does."""
+        return False
+
+    def compress(self, file_content: str, mode: str) -> str:
+        """
+        Returns file_content reduced according to mode (one of OUTPUT_MODES). The base implementation drops
+        blank lines and whole-line comments, line by line, for both "strip" and "signatures".
+        """
+        if mode == "full" or self.comment_prefix is None:
+            return file_content
+        return "".join(line for line in file_content.splitlines(keepends=True)
+                       if line.strip() and not line.lstrip().startswith(self.comment_prefix))
+
+    def process(self, file_content: str, mode: str = "full") -> str | None:
+        """Returns the content to output in mode, or None for a test file."""
+        if self.is_test_file(file_content):
+            return None
+        return self.compress(file_content, mode)
+
+    def process_with_imports(self, file_content: str, mode: str, file_path: str) -> tuple[str | None, set[str]]:
+        """
+        Like process, also returning the modules the file at file_path imports, as dotted names for the import
+        graph. The base handler finds none.
+        """
+        return self.process(file_content, mode), set()
+
+
+# Language name -> (handler module, file extensions)
+LANGUAGES: dict[str, tuple[str, tuple[str, ...]]] = {
+    "python": ("languages.python", (".py",)),
+    "go": ("languages.go", (".go",)),
+    "javascript": ("languages.javascript", (".js", ".jsx", ".mjs", ".cjs")),
+    "typescript": ("languages.typescript", (".ts", ".tsx")),
+    "java": ("languages.java", (".java",)),
+    "rust": ("languages.rust", (".rs",)),
+}
+
+_handlers: dict[str, LanguageHandler] = {}
+_handlers_lock = threading.Lock()
+
+
+def register_language(name: str, module: str, extensions: Iterable[str]) -> None:
+    """Registers (or replaces) the handler module for a language. The module is imported on first use."""
+    with _handlers_lock:
+        LANGUAGES[name] = (module, tuple(extensions))
+        _handlers.pop(name, None)
+
+
+def get_handler(name: str) -> LanguageHandler:
+    """Returns the handler for a registered language, importing its module on first use."""
+    handler = _handlers.get(name)
+    if handler is None:
+        if name not in LANGUAGES:
+            raise ValueError(f"Unknown language: {name}")
+        with _handlers_lock:
+            handler = _handlers.get(name)
+            if handler is None:
+                handler = _handlers[name] = importlib.import_module(LANGUAGES[name][0]).handler
+    return handler
+
+
+def extension_map(languages: Iterable[str]) -> dict[str, str]:
+    """Returns {extension: language} for the given languages. Earlier languages win shared extensions."""
+    routes = {}
+    for name in languages:
+        if name not in LANGUAGES:
+            raise ValueError(f"Unknown language: {name}")
+        for extension in LANGUAGES[name][1]:
+            routes.setdefault(extension, name)
+    return routes
+
+
+def language_for_path(file_path: str, routes: dict[str, str]) -> str | None:
+    """Returns the language an extension_map routes file_path to, or None if it matches none of them."""
+    return routes.get(os.path.splitext(file_path)[1])
@@ -0,0 +1,27 @@
+"""Go handler: detects test files from an import of the standard testing package."""
+import re
+
+from languages import LanguageHandler
+
+# import "testing", import t "testing", or "testing" inside an import ( ... ) block
+SINGLE_IMPORT = re.compile(r'^\s*import\s+(?:[\w.]+\s+)?"testing"', re.MULTILINE)
+IMPORT_BLOCK = re.compile(r"^\s*import\s*\((.*?)\)", re.MULTILINE | re.DOTALL)
+BLOCK_ENTRY = re.compile(r'^\s*(?:[\w.]+\s+)?"testing"', re.MULTILINE)
+
+
+class GoHandler(LanguageHandler):
+    name = "go"
+    extensions = (".go",)
+    excluded_dirs = ("vendor",)
+    excluded_names = ("go.mod", "go.sum", "Makefile")
+    comment_prefix = "//"
+
+    def is_test_file(self, file_content: str, fast: bool = True) -> bool:
+        if '"testing"' not in file_content:
+            return False
+        if SINGLE_IMPORT.search(file_content):
+            return True
+        return any(BLOCK_ENTRY.search(block) for block in IMPORT_BLOCK.findall(file_content))
+
+
+handler = GoHandler()
@@ -0,0 +1,21 @@
+"""Java handler: detects test classes from JUnit, TestNG and Mockito imports."""
+import re
+
+from languages import LanguageHandler
+
+TEST_IMPORT = re.compile(r"^\s*import\s+(?:static\s+)?(?:org\.junit|org\.testng|org\.mockito|junit\.framework)\.",
+                         re.MULTILINE)
+
+
+class JavaHandler(LanguageHandler):
+    name = "java"
+    extensions = (".java",)
+    excluded_dirs = ("target", "build", "gradle")
+    excluded_names = ("package-info.java", "module-info.java")
+    comment_prefix = "//"
+
+    def is_test_file(self, file_content: str, fast: bool = True) -> bool:
+        return TEST_IMPORT.search(file_content) is not None
+
+
+handler = JavaHandler()
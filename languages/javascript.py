@@ -0,0 +1,26 @@
+"""JavaScript handler: detects test files from imports or requires of common test frameworks."""
+import re
+
+from languages import LanguageHandler
+
+TEST_MODULES = ["jest", "@jest/globals", "mocha", "chai", "vitest", "ava", "tape", "jasmine", "supertest", "node:test"]
+TEST_IMPORT = re.compile(
+    r"""(?:\bfrom\s*|\bimport\s*|\brequire\(\s*)['"](?:"""
+    + "|".join(map(re.escape, TEST_MODULES))
+    + r"""|@testing-library/[^'"]+)['"]"""
+)
+
+
+class JavaScriptHandler(LanguageHandler):
+    name = "javascript"
+    extensions = (".js", ".jsx", ".mjs", ".cjs")
+    excluded_dirs = ("node_modules", "dist", "build", "coverage", "__mocks__")
+    excluded_names = (".min.js", "webpack.config", "rollup.config", "vite.config", "babel.config",
+                      "jest.config", "eslint.config")
+    comment_prefix = "//"
+
+    def is_test_file(self, file_content: str, fast: bool = True) -> bool:
+        return TEST_IMPORT.search(file_content) is not None
+
+
+handler = JavaScriptHandler()
@@ -0,0 +1,197 @@
+"""
+Python handler: detects test modules from their unittest/pytest imports, compresses modules
+structurally (comments stripped by a string-aware scanner, API surface rebuilt from the AST) and
+collects their imports for the import graph.
+"""
+import ast
+import re
+from collections.abc import Iterable, Iterator
+
+from languages import LanguageHandler
+
+TEST_INDICATORS = ["unittest", "pytest"]
+# Quick pre-filter: a file can only import a testing library if its name appears in the source
+TEST_INDICATOR_PATTERN = re.compile(r"\b(?:" + "|".join(map(re.escape, TEST_INDICATORS)) + r")\b")
+# The part of Python's lexer comment stripping needs: string literals (triple-quoted ones may span lines)
+# and comments, whichever starts first
+STRING_OR_COMMENT = re.compile(r"""
+    (?P<string>[rRbBuUfF]{0,2}(?:
+        '''(?:\\[\s\S]|[^\\])*?''' | \"\"\"(?:\\[\s\S]|[^\\])*?\"\"\"
+      | '(?:\\.|[^\\'\n])*' | "(?:\\.|[^\\"\n])*"))
+  | (?P<comment>\#[^\n]*)
+""", re.VERBOSE)
+
+
+def iter_statements(module: ast.Module) -> Iterator[ast.AST]:
+    """Yields every statement of a module, including nested ones, without visiting expressions."""
+    stack: list[ast.AST] = list(module.body)
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(child for child in ast.iter_child_nodes(node)
+                     if isinstance(child, (ast.stmt, ast.excepthandler, ast.match_case)))
+
+
+def imports_test_library(nodes: Iterable[ast.AST]) -> bool:
+    """Returns True if any of the nodes imports one of the TEST_INDICATORS modules."""
+    for node in nodes:
+        if isinstance(node, ast.Import):
+            if any(alias.name in TEST_INDICATORS for alias in node.names):
+                return True
+        elif isinstance(node, ast.ImportFrom):
+            if node.module in TEST_INDICATORS:
+                return True
+    return False
+
+
+def module_name_for_path(file_path: str) -> str:
+    """Maps a source path to its dotted module name, e.g. pkg/sub/__init__.py -> pkg.sub."""
+    parts = file_path[:-len(".py")].split("/") if file_path.endswith(".py") else file_path.split("/")
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def imported_names(module: ast.Module, module_name: str, is_package: bool) -> set[str]:
+    """Returns the absolute dotted names a parsed module imports, resolving relative imports against module_name."""
+    package = module_name.split(".") if is_package else module_name.split(".")[:-1]
+    imports = set()
+    for node in iter_statements(module):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base_parts = package[:len(package) - node.level + 1] if node.level > 1 else package
+                base = ".".join(base_parts + ([node.module] if node.module else []))
+            else:
+                base = node.module or ""
+            if base:
+                imports.add(base)
+            # "from pkg import mod" may import a submodule rather than a name
+            imports.update(f"{base}.{alias.name}" if base else alias.name for alias in node.names)
+    return imports
+
+
+def strip_comments(source: str) -> str:
+    """
+    Removes comments and blank lines from Python source, leaving the remaining code untouched.
+    Strings are matched before comments, so a # inside a string is kept, as are blank lines inside
+    multi-line strings.
+    """
+    pieces = []
+    protected: set[int] = set()  # line numbers (from 0) inside multi-line strings
+    position = line = 0
+    for match in STRING_OR_COMMENT.finditer(source):
+        line += source.count("\n", position, match.start())
+        if match.lastgroup == "comment":
+            pieces.append(source[position:match.start()].rstrip(" \t"))
+        else:
+            pieces.append(source[position:match.end()])
+            newlines = match.group().count("\n")
+            protected.update(range(line + 1, line + newlines + 1))
+            line += newlines
+        position = match.end()
+    pieces.append(source[position:])
+    # Comments never span lines, so line numbers are the same before and after removing them
+    return "".join(text for number, text in enumerate("".join(pieces).splitlines(keepends=True))
+                   if number in protected or text.strip())
+
+
+def _docstring(body: list[ast.stmt]) -> list[ast.stmt]:
+    """Returns the docstring statement of a body as a one-element list, or an empty list."""
+    if body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant) \
+            and isinstance(body[0].value.value, str):
+        return body[:1]
+    return []
+
+
+def _surface(body: list[ast.stmt], module_level: bool) -> list[ast.stmt]:
+    """Reduces a module or class body to docstring, imports, assignments, classes and function stubs."""
+    kept = _docstring(body)
+    for node in body[len(kept):]:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            node.body = _docstring(node.body) + [ast.Expr(ast.Constant(...))]
+            kept.append(node)
+        elif isinstance(node, ast.ClassDef):
+            node.body = _surface(node.body, module_level=False) or [ast.Expr(ast.Constant(...))]
+            kept.append(node)
+        elif isinstance(node, (ast.Assign, ast.AnnAssign)) \
+                or module_level and isinstance(node, (ast.Import, ast.ImportFrom)):
+            kept.append(node)
+    return kept
+
+
+def signatures_only(module: ast.Module) -> str:
+    """
+    Renders the API surface of a parsed module: docstrings, imports, module and class level assignments,
+    and class and function definitions whose bodies are replaced by `...`. Modifies the tree in place.
+    """
+    module.body = _surface(module.body, module_level=True)
+    return ast.unparse(module) + "\n"
+
+
+class PythonHandler(LanguageHandler):
+    name = "python"
+    extensions = (".py",)
+    excluded_dirs = ("__pycache__",)
+    excluded_names = ("hubconf.py", "setup.py", "stale.py", "gen-card-", "write_model_card")
+    comment_prefix = "#"
+
+    def is_test_file(self, file_content: str, fast: bool = True) -> bool:
+        """
+        Determine if the file content suggests it is a test file by checking for testing library imports.
+        In fast mode, files that never mention a testing library are rejected without parsing, and parsed
+        modules are searched statement by statement instead of walking every expression node.
+        Both modes give the same answers.
+        """
+        if fast and not TEST_INDICATOR_PATTERN.search(file_content):
+            return False
+        try:
+            module = ast.parse(file_content)
+        except SyntaxError:
+            return False
+        return imports_test_library(iter_statements(module) if fast else ast.walk(module))
+
+    def compress(self, file_content: str, mode: str) -> str:
+        if mode == "full":
+            return file_content
+        if mode == "signatures":
+            try:
+                return signatures_only(ast.parse(file_content))
+            except SyntaxError:
+                pass
+        return strip_comments(file_content)
+
+    def process(self, file_content: str, mode: str = "full") -> str | None:
+        """
+        In "signatures" mode the module is parsed once and the same tree answers the test-file question and
+        is reduced to its API surface. The other modes only parse files that mention a testing library.
+        """
+        if mode != "signatures":
+            return super().process(file_content, mode)
+        try:
+            module = ast.parse(file_content)
+        except SyntaxError:
+            return strip_comments(file_content)
+        return self._process_parsed(module, file_content, mode)
+
+    def process_with_imports(self, file_content: str, mode: str, file_path: str) -> tuple[str | None, set[str]]:
+        """Parses the module once for its imports, the test-file question and the output mode."""
+        try:
+            module = ast.parse(file_content)
+        except (SyntaxError, ValueError):
+            return (file_content if mode == "full" else strip_comments(file_content)), set()
+        # Collected before "signatures" drops the imports nested in function bodies
+        names = imported_names(module, module_name_for_path(file_path), file_path.endswith("__init__.py"))
+        content = self._process_parsed(module, file_content, mode)
+        return content, names if content is not None else set()
+
+    def _process_parsed(self, module: ast.Module, file_content: str, mode: str) -> str | None:
+        if imports_test_library(iter_statements(module)):
+            return None
+        if mode == "signatures":
+            return signatures_only(module)
+        return self.compress(file_content, mode)
+
+
+handler = PythonHandler()
@@ -0,0 +1,21 @@
+"""Rust handler: only whole files compiled for tests (#![cfg(test)]) count as test files."""
+import re
+
+from languages import LanguageHandler
+
+# Inline #[cfg(test)] modules are part of ordinary source files and are kept
+TEST_CRATE_ATTRIBUTE = re.compile(r"^\s*#!\[cfg\(test\)\]", re.MULTILINE)
+
+
+class RustHandler(LanguageHandler):
+    name = "rust"
+    extensions = (".rs",)
+    excluded_dirs = ("target",)
+    excluded_names = ("build.rs",)
+    comment_prefix = "//"
+
+    def is_test_file(self, file_content: str, fast: bool = True) -> bool:
+        return TEST_CRATE_ATTRIBUTE.search(file_content) is not None
+
+
+handler = RustHandler()
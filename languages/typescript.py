@@ -0,0 +1,11 @@
+"""TypeScript handler: JavaScript's rules, minus generated declaration files."""
+from languages.javascript import JavaScriptHandler
+
+
+class TypeScriptHandler(JavaScriptHandler):
+    name = "typescript"
+    extensions = (".ts", ".tsx")
+    excluded_names = JavaScriptHandler.excluded_names + (".d.ts",)
+
+
+handler = TypeScriptHandler()
@@ -0,0 +1,258 @@
+"""
+Repository sources and the per-file worker that runs on the process pool.
+
+Files are read through a RepositorySource: a downloaded zip archive, or a git repository on disk (a local
+clone, a file:// URL or a bare mirror) whose blobs are read with `git cat-file --batch`. Git sources accept
+any branch, tag or commit.
+
+Pool workers import this module rather than app.py, so it depends on nothing but the standard library and
+the language handlers: a worker starts without loading NiceGUI, FastAPI or the token encoder.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO
+
+from languages import get_handler
+
+
+class SourceError(Exception):
+    """Raised when a git repository, ref or object cannot be read."""
+
+
+def run_git(git_dir: str | Path, *args: str, input: str | None = None) -> str:
+    """Runs a git command in git_dir and returns its output. Raises SourceError if it fails."""
+    try:
+        result = subprocess.run(["git", "-C", str(git_dir), *args], input=input, capture_output=True, check=True,
+                                text=True, encoding="utf-8", errors="surrogateescape")
+    except FileNotFoundError:
+        raise SourceError("git is not installed.")
+    except subprocess.CalledProcessError as e:
+        raise SourceError(e.stderr.strip() or f"git {args[0]} failed with exit code {e.returncode}.")
+    return result.stdout
+
+
+class RepositorySource:
+    """
+    The files of one repository snapshot, addressed by their path from the repository root.
+    A source is read from one thread; worker processes open their own copy from the spec yielded by shared().
+    """
+    commit: str | None = None
+
+    def list_files(self) -> list[str]:
+        raise NotImplementedError
+
+    def version(self, path: str) -> list:
+        """Returns an identifier of the file's content that changes whenever the content does."""
+        raise NotImplementedError
+
+    def read(self, path: str) -> bytes:
+        raise NotImplementedError
+
+    def prefetch(self, paths: Iterable[str]) -> int:
+        """Makes the given files available locally before they are read. Returns how many had to be fetched."""
+        return 0
+
+    @contextmanager
+    def shared(self) -> Iterator[tuple]:
+        """Yields a picklable spec from which open_source opens the same snapshot in another process."""
+        raise NotImplementedError
+        yield
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "RepositorySource":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class ZipSource(RepositorySource):
+    """A GitHub archive. Paths drop the archive's top-level directory; archive, if given, is closed with the source."""
+
+    def __init__(self, zip_file: zipfile.ZipFile, archive: BinaryIO | None = None):
+        self.zip_file = zip_file
+        self.archive = archive
+        self._entries: dict[str, zipfile.ZipInfo] = {}
+        for info in zip_file.infolist():
+            path = "/".join(info.filename.split('/')[1:])
+            if path and not info.is_dir():
+                self._entries[path] = info
+
+    def list_files(self) -> list[str]:
+        return list(self._entries)
+
+    def version(self, path: str) -> list:
+        info = self._entries[path]
+        return [info.CRC, info.file_size]
+
+    def read(self, path: str) -> bytes:
+        return self.zip_file.read(self._entries[path])
+
+    @contextmanager
+    def shared(self) -> Iterator[tuple]:
+        with archive_on_disk(self.zip_file) as archive_path:
+            yield "zip", archive_path
+
+    def close(self) -> None:
+        self.zip_file.close()
+        if self.archive is not None:
+            self.archive.close()
+
+
+class GitSource(RepositorySource):
+    """One commit of a git repository on disk, bare or not. Blobs are streamed from a `git cat-file --batch` process."""
+
+    def __init__(self, git_dir: str, commit: str):
+        self.git_dir = git_dir
+        self.commit = commit
+        self._blobs: dict[str, str] | None = None  # path -> blob id
+        self._cat_file: subprocess.Popen | None = None
+
+    @classmethod
+    def open(cls, git_dir: str, ref: str) -> "GitSource":
+        """Opens a branch, tag or commit of the repository at git_dir."""
+        try:
+            commit = run_git(git_dir, "rev-parse", "--verify", "--end-of-options", f"{ref}^{{commit}}").strip()
+        except SourceError as e:
+            raise SourceError(f"Cannot read {ref!r} from {git_dir}: {e}")
+        return cls(git_dir, commit)
+
+    def _tree(self) -> dict[str, str]:
+        if self._blobs is None:
+            # Without --long, listing the tree needs no blobs, so it also works on partial clones
+            listing = run_git(self.git_dir, "ls-tree", "-r", "-z", "--full-tree", self.commit)
+            self._blobs = {}
+            for record in listing.split("\0"):
+                if not record:
+                    continue
+                meta, path = record.split("\t", 1)
+                mode, kind, blob = meta.split()
+                if kind == "blob" and mode != "120000":  # skip submodules and symlinks
+                    self._blobs[path] = blob
+        return self._blobs
+
+    def list_files(self) -> list[str]:
+        return list(self._tree())
+
+    def version(self, path: str) -> list:
+        return [self._tree()[path]]
+
+    def read(self, path: str) -> bytes:
+        if self._cat_file is None:
+            self._cat_file = subprocess.Popen(["git", "-C", self.git_dir, "cat-file", "--batch"],
+                                              stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # Workers that never listed the tree name the blob by commit and path
+        name = self._blobs[path] if self._blobs is not None else f"{self.commit}:{path}"
+        self._cat_file.stdin.write(name.encode("utf-8", "surrogateescape") + b"\n")
+        self._cat_file.stdin.flush()
+        header = self._cat_file.stdout.readline().split()
+        if len(header) != 3:
+            raise SourceError(f"Object not found: {path}")
+        content = self._cat_file.stdout.read(int(header[2]))
+        self._cat_file.stdout.read(1)  # newline after the object
+        return content
+
+    def prefetch(self, paths: Iterable[str]) -> int:
+        """In a partial clone, fetches the missing blobs of paths in a single request."""
+        try:
+            if run_git(self.git_dir, "config", "--get", "remote.origin.promisor").strip() != "true":
+                return 0
+        except SourceError:
+            return 0
+        blobs = self._tree()
+        wanted = {blobs[path] for path in paths}
+        listing = run_git(self.git_dir, "rev-list", "--objects", "--missing=print", self.commit)
+        missing = sorted(wanted.intersection(line[1:] for line in listing.splitlines() if line.startswith("?")))
+        if missing:
+            # The same request git makes when it fetches missing objects of a partial clone on demand
+            run_git(self.git_dir, "-c", "fetch.negotiationAlgorithm=noop", "fetch", "--quiet", "--no-tags",
+                    "--no-write-fetch-head", "--recurse-submodules=no", "--filter=blob:none", "--stdin", "origin",
+                    input="\n".join(missing) + "\n")
+        return len(missing)
+
+    @contextmanager
+    def shared(self) -> Iterator[tuple]:
+        yield "git", self.git_dir, self.commit
+
+    def close(self) -> None:
+        if self._cat_file is not None:
+            self._cat_file.stdin.close()
+            self._cat_file.stdout.close()
+            self._cat_file.wait()
+            self._cat_file = None
+
+
+def open_source(spec: tuple) -> RepositorySource:
+    """Opens the source described by a spec from RepositorySource.shared."""
+    kind, *args = spec
+    if kind == "zip":
+        return ZipSource(zipfile.ZipFile(args[0]))
+    if kind == "git":
+        return GitSource(*args)
+    raise ValueError(f"Unknown source kind: {kind}")
+
+
+@contextmanager
+def archive_on_disk(zip_file: zipfile.ZipFile) -> Iterator[str]:
+    """Yields a filesystem path to the archive behind zip_file, copying in-memory archives to a temp file."""
+    if isinstance(zip_file.filename, str) and os.path.isfile(zip_file.filename):
+        yield zip_file.filename
+        return
+    with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as copy:
+        zip_file.fp.seek(0)
+        shutil.copyfileobj(zip_file.fp, copy)
+    try:
+        yield copy.name
+    finally:
+        os.unlink(copy.name)
+
+
+# --- Worker ---
+# Workers open the source themselves from its spec (the archive on disk, or the git repository) and keep it
+# open across the batches of file paths they receive.
+
+_worker_source: tuple[tuple, RepositorySource] | None = None
+
+
+def process_archive_entry(source: RepositorySource, file_path: str, lang: str, mode: str = "full",
+                          imports: bool = False) -> tuple[str, str, str | None, list[str] | None]:
+    """
+    Reads, decodes, classifies and compresses (according to mode, one of OUTPUT_MODES) one file of source.
+    Returns ("ok", content, original, imported), ("test", "", None, None) or ("error", error message, None, None),
+    where original is the decoded file if compression changed it and None otherwise, and imported lists the
+    modules the file imports if imports is set (from the same parse as test detection) and is None otherwise.
+    """
+    try:
+        file_content = source.read(file_path).decode("utf-8")
+    except (UnicodeDecodeError, Exception) as e:
+        return "error", str(e), None, None
+
+    handler = get_handler(lang)
+    if imports:
+        content, names = handler.process_with_imports(file_content, mode, file_path)
+        imported = sorted(names)
+    else:
+        content, imported = handler.process(file_content, mode), None
+    if content is None:
+        return "test", "", None, None
+    return "ok", content, file_content if content != file_content else None, imported
+
+
+def process_entry_batch(spec: tuple, entries: list[tuple[str, str]], mode: str = "full",
+                        imports: bool = False) -> list[tuple[str, str, str | None, list[str] | None]]:
+    """Worker entry point: processes a batch of entries, reusing the open source between batches."""
+    global _worker_source
+    if _worker_source is None or _worker_source[0] != spec:
+        if _worker_source is not None:
+            _worker_source[1].close()
+        _worker_source = (spec, open_source(spec))
+    source = _worker_source[1]
+    return [process_archive_entry(source, file_path, lang, mode, imports) for file_path, lang in entries]
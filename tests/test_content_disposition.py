@@ -0,0 +1,20 @@
+"""Tests for the Content-Disposition header built from user-supplied ref names."""
+import urllib.parse
+
+import app
+
+
+def test_plain_filename_is_kept():
+    assert app.content_disposition("owner_repo_main.txt") == \
+        "inline; filename=\"owner_repo_main.txt\"; filename*=UTF-8''owner_repo_main.txt"
+
+
+def test_special_characters_cannot_break_the_header():
+    name = 'owner_repo_feat/"quoted";\r\nX-Injected: 1 ä.txt'
+    header = app.content_disposition(name, "attachment")
+    fallback = header.split('filename="', 1)[1].split('"', 1)[0]
+    encoded = header.split("filename*=UTF-8''", 1)[1]
+    assert header.startswith("attachment; ")
+    assert "\r" not in header and "\n" not in header
+    assert fallback.isascii() and '"' not in fallback and ";" not in fallback
+    assert urllib.parse.unquote(encoded) == name
@@ -0,0 +1,186 @@
+"""
+Tests for HttpClient and fetch_archive against a local stand-in HTTP server.
+Each test scripts the server's responses and checks what the client sent and how often.
+"""
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import app
+
+ARCHIVE = b"PK" + bytes(range(256)) * 64
+
+
+class StandInServer:
+    """
+    Serves scripted responses, one per request, repeating the last one. A response is a dict with
+    status, headers, body, and optionally delay (seconds before responding) or truncate (bytes of the body
+    actually sent before the connection is closed).
+    """
+
+    def __init__(self, responses: list[dict]):
+        self.responses = responses
+        self.requests: list[dict] = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                response = server.responses[min(len(server.requests), len(server.responses)) - 1]
+                time.sleep(response.get("delay", 0))
+                body = response.get("body", b"")
+                self.send_response(response.get("status", 200))
+                for name, value in response.get("headers", {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if "truncate" in response:
+                    self.wfile.write(body[:response["truncate"]])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                else:
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/archive/refs/heads/main.zip"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(*responses: dict) -> StandInServer:
+        servers.append(StandInServer(list(responses)))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    """Records the retry delays of the test thread instead of sleeping; server threads still sleep."""
+    recorded = []
+    test_thread, sleep = threading.current_thread(), time.sleep
+
+    def fake_sleep(seconds):
+        if threading.current_thread() is test_thread:
+            recorded.append(seconds)
+        else:
+            sleep(seconds)
+
+    monkeypatch.setattr(app.time, "sleep", fake_sleep)
+    return recorded
+
+
+def closed_port_url() -> str:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    return f"http://127.0.0.1:{port}/archive/refs/heads/main.zip"
+
+
+def read(archive) -> bytes:
+    with archive:
+        return archive.read()
+
+
+def test_unreachable_host_is_attempted_retries_plus_one_times(delays):
+    client = app.HttpClient(retries=3, backoff=0.01)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        app.fetch_archive(closed_port_url(), app.NullLog(), client=client, cache=None)
+    assert client.stats()["requests"] == 4
+    assert len(delays) == 3
+
+
+def test_retryable_status_is_retried_until_success(serve, delays):
+    server = serve({"status": 503}, {"status": 502}, {"body": ARCHIVE})
+    client = app.HttpClient(retries=3, backoff=0.01)
+    assert read(app.fetch_archive(server.url, app.NullLog(), client=client, cache=None)) == ARCHIVE
+    assert len(server.requests) == 3
+
+
+def test_retryable_status_gives_up_after_retries(serve, delays):
+    server = serve({"status": 503})
+    client = app.HttpClient(retries=2, backoff=0.01)
+    with pytest.raises(requests.exceptions.HTTPError):
+        app.fetch_archive(server.url, app.NullLog(), client=client, cache=None)
+    assert len(server.requests) == 3
+
+
+def test_retry_after_header_sets_the_delay(serve, delays):
+    server = serve({"status": 429, "headers": {"Retry-After": "7"}}, {"body": ARCHIVE})
+    client = app.HttpClient(retries=3, backoff=0.01)
+    assert read(app.fetch_archive(server.url, app.NullLog(), client=client, cache=None)) == ARCHIVE
+    assert delays == [7.0]
+
+
+def test_interrupted_transfer_is_retried(serve, delays):
+    server = serve({"body": ARCHIVE, "truncate": 100}, {"body": ARCHIVE})
+    client = app.HttpClient(retries=3, backoff=0.01)
+    assert read(app.fetch_archive(server.url, app.NullLog(), client=client, cache=None)) == ARCHIVE
+    assert len(server.requests) == 2
+
+
+def test_unchanged_archive_is_revalidated_with_etag(serve, tmp_path, delays):
+    server = serve({"body": ARCHIVE, "headers": {"ETag": '"v1"'}}, {"status": 304, "headers": {"ETag": '"v1"'}})
+    client = app.HttpClient(retries=0)
+    cache = app.ArchiveCache(str(tmp_path))
+
+    assert read(app.fetch_archive(server.url, app.NullLog(), client=client, cache=cache)) == ARCHIVE
+    assert read(app.fetch_archive(server.url, app.NullLog(), client=client, cache=cache)) == ARCHIVE
+    assert "If-None-Match" not in server.requests[0]
+    assert server.requests[1]["If-None-Match"] == '"v1"'
+    assert client.stats()["not_modified"] == 1
+    assert list(tmp_path.glob("*.partial")) == []
+
+
+def test_changed_archive_replaces_the_cached_copy(serve, tmp_path, delays):
+    updated = ARCHIVE[::-1]
+    server = serve({"body": ARCHIVE, "headers": {"ETag": '"v1"'}}, {"body": updated, "headers": {"ETag": '"v2"'}})
+    client = app.HttpClient(retries=0)
+    cache = app.ArchiveCache(str(tmp_path))
+
+    read(app.fetch_archive(server.url, app.NullLog(), client=client, cache=cache))
+    assert read(app.fetch_archive(server.url, app.NullLog(), client=client, cache=cache)) == updated
+    assert cache.lookup(server.url)[1] == '"v2"'
+
+
+def test_connect_and_read_timeouts_are_passed_separately(monkeypatch):
+    client = app.HttpClient(connect_timeout=1.5, read_timeout=12.0)
+    seen = {}
+
+    def fake_get(url, **kwargs):
+        seen.update(kwargs)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    monkeypatch.setattr(client.session, "get", fake_get)
+    client.get("http://example.invalid/")
+    assert seen["timeout"] == (1.5, 12.0)
+
+
+def test_read_timeout_does_not_wait_for_the_connect_timeout(serve):
+    server = serve({"body": ARCHIVE, "delay": 2})
+    client = app.HttpClient(retries=0, connect_timeout=30.0, read_timeout=0.2)
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.get(server.url)
+    assert time.monotonic() - started < 1.5
@@ -0,0 +1,16 @@
+"""
+Tests for the Prometheus text rendering of MetricsRegistry.
+"""
+import app
+
+
+def test_stats_render_as_counters_and_gauges():
+    text = app.MetricsRegistry().render(counters={"result_cache": {"hits": 3}}, gauges={"result_cache": {"entries": 2}})
+    assert "# TYPE repo2llm_result_cache_hits_total counter\nrepo2llm_result_cache_hits_total 3\n" in text
+    assert "# TYPE repo2llm_result_cache_entries gauge\nrepo2llm_result_cache_entries 2\n" in text
+
+
+def test_label_values_are_escaped():
+    registry = app.MetricsRegistry()
+    registry.inc("repo2llm_jobs_total", result='a\\b "c"\nd')
+    assert 'repo2llm_jobs_total{result="a\\\\b \\"c\\"\\nd"} 1\n' in registry.render()
@@ -0,0 +1,41 @@
+"""
+Tests that the fast Python test-file detector (regex pre-filter, statement walk) agrees with the full AST walk.
+Each source is classified by both and checked against the expected verdict.
+"""
+import pytest
+
+from languages import get_handler
+
+SOURCES = {
+    "import pytest": ("import pytest\n\ndef test_one():\n    assert True\n", True),
+    "import unittest": ("import unittest\n\nclass T(unittest.TestCase):\n    pass\n", True),
+    "from pytest import": ("from pytest import fixture\n", True),
+    "from unittest import": ("from unittest import mock\n", True),
+    "aliased import": ("import pytest as pt\n", True),
+    "aliased from import": ("from unittest import TestCase as Case\n", True),
+    "one of several names": ("import os, sys, unittest\n", True),
+    "continued line": ("import os, \\\n    pytest\n", True),
+    "import in a function": ("def run():\n    import pytest\n    return pytest.main()\n", True),
+    "import in try/except": ("try:\n    import json\nexcept ImportError:\n    import unittest\n", True),
+    "import in a class body": ("class Base:\n    import unittest\n", True),
+    "import in a match case": ("match mode:\n    case 'test':\n        import pytest\n", True),
+    "submodule import": ("import unittest.mock\n", False),
+    "other library": ("import numpy as np\n\nprint(np.zeros(3))\n", False),
+    "similar name": ("import pytest_plugins\nimport myunittest\n", False),
+    "relative import": ("from . import pytest\n", False),
+    "mention in a string": ('HELP = "run the suite with pytest or unittest"\n', False),
+    "mention in a docstring": ('"""\nimport pytest\n"""\n\ndef f():\n    pass\n', False),
+    "mention in a comment": ("# import unittest\nx = 1\n", False),
+    "attribute access": ("runner = config.pytest\n", False),
+    "syntax error": ("import pytest\ndef broken(:\n", False),
+    "syntax error without mention": ("def broken(:\n", False),
+    "empty file": ("", False),
+}
+
+
+@pytest.mark.parametrize("name", list(SOURCES))
+def test_fast_detector_agrees_with_ast_walk(name):
+    handler = get_handler("python")
+    source, expected = SOURCES[name]
+    assert handler.is_test_file(source, fast=False) == expected
+    assert handler.is_test_file(source, fast=True) == expected